@@ -0,0 +1,142 @@
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import os
+import shutil
+
+
+"""Maximum number of objective values held by an evaluation cache."""
+EVALUATION_CACHE_SIZE = 50000
+
+"""Number of digits the grid of an evaluation cache is finer than the tolerance of the optimization."""
+EVALUATION_GRID_DIGITS = 2
+
+
+class FastDmEstimateCache:
+
+    def __init__(self, cacheDir, maxSize):
+        """
+        Creates a cache of parameter files shared across sessions. Entries are
+        addressed by the contents of everything which determines an estimate, and
+        the least recently used entries are evicted once maxSize (bytes) is exceeded.
+        """
+
+        self._cacheDir = cacheDir
+        self._maxSize = maxSize
+
+        # Create cache dir, if it does not exist
+        if not os.path.isdir(self._cacheDir):
+            os.makedirs(self._cacheDir)
+
+        # Determine current size once, keep track of it afterwards
+        self._size = sum(os.path.getsize(fileName) for fileName in self._entries())
+
+    @staticmethod
+    def key(dataHash, templateHash, method, precision):
+        """Returns the cache key of a data set estimated with a given control template."""
+
+        text = ';'.join([dataHash, templateHash, method, str(precision)])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key, targetFileName):
+        """Copies a cached parameter file to targetFileName, returns False if not cached."""
+
+        fileName = self._fileName(key)
+        if not os.path.isfile(fileName):
+            return False
+
+        shutil.copyfile(fileName, targetFileName)
+        # Mark as recently used
+        os.utime(fileName, None)
+        return True
+
+    def put(self, key, sourceFileName):
+        """Stores a parameter file under the given key and evicts old entries, if needed."""
+
+        fileName = self._fileName(key)
+        if os.path.isfile(fileName):
+            self._size -= os.path.getsize(fileName)
+
+        shutil.copyfile(sourceFileName, fileName)
+        self._size += os.path.getsize(fileName)
+
+        if self._size > self._maxSize:
+            self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until cache is below 90% of max size."""
+
+        # Sort entries by last use, oldest first
+        entries = sorted(self._entries(), key=os.path.getmtime)
+
+        for fileName in entries:
+            if self._size <= 0.9 * self._maxSize:
+                break
+            self._size -= os.path.getsize(fileName)
+            os.remove(fileName)
+
+    def _entries(self):
+        """Returns the file names of all cache entries."""
+
+        return [self._cacheDir + '/' + fileName for fileName in os.listdir(self._cacheDir)
+                if fileName.endswith('.dat')]
+
+    def _fileName(self, key):
+        """Returns the file name of a cache entry."""
+
+        return self._cacheDir + '/' + key + '.dat'
+
+
+class FastDmEvaluationCache:
+
+    def __init__(self, precision, maxSize=EVALUATION_CACHE_SIZE):
+        """
+        Creates an in-memory cache of objective values of the native estimator. Parameters
+        are quantized to a grid of 10^-(precision + EVALUATION_GRID_DIGITS), finer than the
+        tolerance of the optimization, so only parameter vectors the optimizer revisits (almost)
+        exactly share one entry, and the least recently used entries are evicted once
+        maxSize entries are held. Counts hits and misses.
+        """
+
+        self._resolution = 10.0 ** -(float(precision) + EVALUATION_GRID_DIGITS)
+        self._maxSize = maxSize
+        self._values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, values):
+        """Returns parameter values (array) rounded to the grid, evaluating there keeps cached values exact."""
+
+        return np.round(np.asarray(values, dtype=float) / self._resolution) * self._resolution
+
+    def key(self, dataset, values):
+        """Returns the cache key of parameter values (on the grid) of a data set (any hashable id)."""
+
+        return (dataset,) + tuple(int(round(value / self._resolution)) for value in values)
+
+    def get(self, key):
+        """Returns the cached value of key, None if not cached."""
+
+        if key not in self._values:
+            self.misses += 1
+            return None
+
+        # Mark as recently used
+        self._values.move_to_end(key)
+        self.hits += 1
+        return self._values[key]
+
+    def put(self, key, value):
+        """Stores the value of key and evicts the least recently used entry, if needed."""
+
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self._maxSize:
+            self._values.popitem(last=False)
+
+    def summary(self):
+        """Returns hit and miss counts as a line for the log."""
+
+        total = max(self.hits + self.misses, 1)
+        return 'Evaluation cache: {} hits, {} misses ({:.0%} hits)'.format(self.hits, self.misses,
+                                                                          self.hits / total)
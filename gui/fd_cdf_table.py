@@ -0,0 +1,273 @@
+from fd_process_pool import ABORT_LATENCY
+from fd_wiener import wienerCdf, lowerThresholdProbability, mixContaminants
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+import os
+
+
+"""
+Grid of the lookup table. Decision time cdfs at the lower threshold depend on the starting
+point w, the drift and its variability scaled by the threshold (v * a, sv * a), the starting
+point variability szr and the normalized time t / a^2 only, the upper threshold is mirrored
+and non-decision times shift (t0, d) or average (st0) the cdfs exactly.
+"""
+TABLE_W = np.linspace(0.1, 0.9, 17)
+TABLE_VA = np.linspace(-10.0, 10.0, 41)
+TABLE_SVA = np.linspace(0.0, 3.0, 7)
+TABLE_SZR = np.linspace(0.0, 0.4, 5)
+
+"""
+Number of normalized times per cdf, spaced quadratically (cdfs rise fast early) up to
+TABLE_MAX_TIME, which shrinks for strong drifts (see _timeSpan).
+"""
+TABLE_TIMES = 240
+TABLE_MAX_TIME = 10.0
+
+"""Resolution of the exact cdfs the table is built from (see wienerCdf)."""
+TABLE_RESOLUTION = 2000
+
+"""Tables opened by this process, shared by all estimators as file name -> FastDmCdfTable."""
+_OPEN_TABLES = {}
+
+
+class FastDmCdfTable:
+
+    def __init__(self, fileName):
+        """
+        Opens a lookup table written by buildCdfTable. The table is memory-mapped read-only,
+        so all processes using the same file share a single copy in memory.
+        """
+
+        self._table = np.load(fileName, mmap_mode='r')
+        if self._table.shape != _tableShape():
+            raise ValueError('cdf table {} does not match the grid, delete it to rebuild'.format(fileName))
+        # Flat view of the same memory, indexed by plain arrays much faster than the memmap
+        self._flat = np.asarray(self._table).reshape(-1)
+
+    def cdf(self, x, a, zr, v, t0, d=0.0, szr=0.0, sv=0.0, st0=0.0, p=0.0, contaminants=None):
+        """
+        Returns predicted cdfs as wienerCdf does, but interpolated (multilinear) from the table
+        in constant time per point. Rows whose parameters lie outside the grid are calculated
+        exactly by wienerCdf.
+        """
+
+        # Bring parameters into column shape (rows, 1) and grid into (rows, points), as wienerCdf
+        params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(arg, dtype=float)) for arg in
+                                       (a, zr, v, t0, d, szr, sv, st0, p)])
+        a, zr, v, t0, d, szr, sv, st0, p = [param[:, np.newaxis] for param in params]
+        x = np.asarray(x, dtype=float)
+        x = np.broadcast_to(x, (a.shape[0], x.shape[-1]))
+
+        # Rows covered by the grid, for both thresholds
+        inside = ((np.minimum(zr, 1.0 - zr) >= TABLE_W[0]) & (np.abs(v * a) <= TABLE_VA[-1]) &
+                  (sv * a <= TABLE_SVA[-1]) & (szr <= TABLE_SZR[-1]))[:, 0]
+
+        cdf = np.empty(x.shape)
+        if (~inside).any():
+            cdf[~inside] = wienerCdf(x[~inside], a[~inside, 0], zr[~inside, 0], v[~inside, 0], t0[~inside, 0],
+                                     d[~inside, 0], szr[~inside, 0], sv[~inside, 0], st0[~inside, 0])
+        if inside.any():
+            cdf[inside] = self._interpolatedCdf(x[inside], *[param[inside] for param in
+                                                             (a, zr, v, t0, d, szr, sv, st0)])
+
+        return np.clip(mixContaminants(cdf, x, p, contaminants), 0.0, 1.0)
+
+    def _interpolatedCdf(self, x, a, zr, v, t0, d, szr, sv, st0):
+        """Cdfs of rows inside the grid, without contaminants."""
+
+        cdf = np.empty(x.shape)
+        for upper in (False, True):
+
+            # Mirror upper threshold onto the lower one, position of parameters on the grid
+            w = 1.0 - zr if upper else zr
+            drift = -v if upper else v
+            nonDecision = t0 + 0.5 * d if upper else t0 - 0.5 * d
+            corners = self._corners(w, drift * a, sv * a, szr)
+
+            # Threshold probability exactly, the table holds cdfs conditional on the threshold
+            probability = lowerThresholdProbability(a, w, drift, szr, sv)
+
+            # Conditional cdf of each row, blended from the corners once, and its integral
+            knots, rowCdf, rowIntegral = self._rows(corners)
+
+            # Shift by non-decision time, averaged over its uniform range if st0 > 0
+            times = np.abs(x) - nonDecision
+            scale = a * a
+            withoutSt0 = _interpolate(knots, rowCdf, rowIntegral, times / scale)
+            safeSt0 = np.where(st0 > 0, st0, 1.0)
+            withSt0 = scale * (_interpolate(knots, rowCdf, rowIntegral, (times + 0.5 * st0) / scale, True) -
+                               _interpolate(knots, rowCdf, rowIntegral, (times - 0.5 * st0) / scale, True)) / safeSt0
+            thresholdCdf = probability * np.where(st0 > 0, withSt0, withoutSt0)
+
+            # Combine: below zero lower responses slower than |x|, above zero all lower plus faster upper
+            if upper:
+                cdf = np.where(x >= 0, lowerProbability + thresholdCdf, cdf)
+            else:
+                lowerProbability = probability
+                cdf = np.where(x < 0, probability - thresholdCdf, cdf)
+
+        return cdf
+
+    def _corners(self, w, va, sva, szr):
+        """
+        Returns weights, flat table offsets (of time 0) and time spans of all corners of the grid
+        cells holding the parameters (rows, 1), stacked along a first axis of corners.
+        """
+
+        positions = [_gridPosition(w, TABLE_W), _gridPosition(va, TABLE_VA),
+                     _gridPosition(sva, TABLE_SVA), _gridPosition(szr, TABLE_SZR)]
+        offsets = np.array(list(itertools.product((0, 1), repeat=len(positions))))[:, :, np.newaxis, np.newaxis]
+        indices = [index + offsets[:, dim] for dim, (index, fraction) in enumerate(positions)]
+        weights = np.prod([np.where(offsets[:, dim], fraction, 1.0 - fraction)
+                           for dim, (index, fraction) in enumerate(positions)], axis=0)
+        base = np.ravel_multi_index(tuple(indices) + (0,), self._table.shape)
+        return weights, base, _timeSpan(TABLE_VA[indices[1]], TABLE_SVA[indices[2]])
+
+    def _rows(self, corners):
+        """
+        Returns times, conditional cdf and its integral of each row (rows, TABLE_TIMES), blended
+        from all corners at times spaced as in the table up to the corners' mean span, so the
+        cost per row does not depend on the number of points.
+        """
+
+        weights, base, span = corners
+        knots = (weights * span).sum(axis=0) * np.linspace(0.0, 1.0, TABLE_TIMES) ** 2
+        cdf = self._lookup(corners, knots)
+        integral = np.zeros(cdf.shape)
+        integral[:, 1:] = np.cumsum(0.5 * (cdf[:, 1:] + cdf[:, :-1]) * np.diff(knots, axis=1), axis=1)
+        return knots, cdf, integral
+
+    def _lookup(self, corners, u):
+        """Interpolates the conditional cdf at normalized times u (rows, points) from all corners."""
+
+        weights, base, span = corners
+
+        # Times of the table enclosing u, quadratically spaced up to the span of each corner
+        clipped = np.clip(u, 0.0, span)
+        lower = np.minimum((np.sqrt(clipped / span) * (TABLE_TIMES - 1)).astype(int), TABLE_TIMES - 2)
+        lowerTime = span * (lower / (TABLE_TIMES - 1.0)) ** 2
+        upperTime = span * ((lower + 1) / (TABLE_TIMES - 1.0)) ** 2
+
+        # Cdf at both times of all corners at once, linear in between
+        index = base + lower
+        below = self._flat[index]
+        value = below + (self._flat[index + 1] - below) * (clipped - lowerTime) / (upperTime - lowerTime)
+        return (weights * value).sum(axis=0)
+
+
+def openCdfTable(fileName):
+    """Returns the lookup table in fileName, opened only once per process."""
+
+    if fileName not in _OPEN_TABLES:
+        _OPEN_TABLES[fileName] = FastDmCdfTable(fileName)
+    return _OPEN_TABLES[fileName]
+
+
+def cdfTableFileName(directory):
+    """Returns the name of the table file in directory, which changes whenever the grid does."""
+
+    grid = repr([TABLE_W.tolist(), TABLE_VA.tolist(), TABLE_SVA.tolist(), TABLE_SZR.tolist(),
+                 TABLE_TIMES, TABLE_MAX_TIME, TABLE_RESOLUTION])
+    return directory + '/cdf_table_' + hashlib.sha1(grid.encode('utf-8')).hexdigest()[:12] + '.npy'
+
+
+def buildCdfTable(fileName, jobs=1, flag=None):
+    """
+    Calculates the table of conditional decision time cdfs with jobs processes and writes it to
+    fileName, via a temporary file, so other processes never see a partial table. The run flag
+    (see FastDmEstimation) is checked between slices, returns False if stopped, True if built.
+    """
+
+    flag = flag if flag is not None else {'run': True}
+
+    # Each task is a single starting point and starting point variability
+    tasks = list(itertools.product(range(len(TABLE_W)), range(len(TABLE_SZR))))
+    slices = []
+    if jobs > 1:
+        # Leaving the pool terminates slices still running
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.imap(_buildSlice, tasks)
+            while len(slices) < len(tasks):
+                if not flag['run']:
+                    return False
+                try:
+                    slices.append(results.next(timeout=ABORT_LATENCY))
+                except multiprocessing.TimeoutError:
+                    pass
+    else:
+        for task in tasks:
+            if not flag['run']:
+                return False
+            slices.append(_buildSlice(task))
+
+    table = np.empty(_tableShape(), dtype=np.float32)
+    for (wIdx, szrIdx), cdf in zip(tasks, slices):
+        table[wIdx, :, :, szrIdx] = cdf
+
+    tempFileName = fileName + '.tmp'
+    with open(tempFileName, 'wb') as tableFile:
+        np.save(tableFile, table)
+    os.replace(tempFileName, fileName)
+    return True
+
+
+def _buildSlice(task):
+    """Returns conditional cdfs of all drifts and drift variabilities of a grid cell (w, szr)."""
+
+    wIdx, szrIdx = task
+    w = TABLE_W[wIdx]
+    # Starting points have to stay between the thresholds, largest valid variability at the border
+    szr = min(TABLE_SZR[szrIdx], 2.0 * min(w, 1.0 - w) - 1e-3)
+    va, sva = [grid.ravel()[:, np.newaxis] for grid in np.meshgrid(TABLE_VA, TABLE_SVA, indexing='ij')]
+
+    # Normalized times of each row, lower threshold cdf from the signed cdf at -u (a = 1, t0 = 0)
+    u = _timeSpan(va, sva) * np.linspace(0.0, 1.0, TABLE_TIMES) ** 2
+    signed = wienerCdf(-u, 1.0, w, va[:, 0], 0.0, szr=szr, sv=sva[:, 0], resolution=TABLE_RESOLUTION)
+    probability = np.maximum(signed[:, :1], 1e-300)
+    cdf = np.clip(np.maximum.accumulate((signed[:, :1] - signed) / probability, axis=1), 0.0, 1.0)
+    return cdf.reshape((len(TABLE_VA), len(TABLE_SVA), TABLE_TIMES))
+
+
+def _timeSpan(va, sva):
+    """Returns the largest normalized time of the cdfs at drift va, shorter for strong drifts."""
+
+    return TABLE_MAX_TIME / (1.0 + np.maximum(np.abs(va) - 2.0 * sva, 0.0))
+
+
+def _tableShape():
+    """Returns the shape of the table: w, v * a, sv * a, szr and time."""
+
+    return (len(TABLE_W), len(TABLE_VA), len(TABLE_SVA), len(TABLE_SZR), TABLE_TIMES)
+
+
+def _gridPosition(values, grid):
+    """Returns the index of the grid cell holding each value and the relative position within it."""
+
+    position = np.clip((values - grid[0]) / (grid[1] - grid[0]), 0.0, len(grid) - 1.0)
+    lower = np.minimum(position.astype(int), len(grid) - 2)
+    return lower, position - lower
+
+
+def _interpolate(knots, cdf, integral, u, integrate=False):
+    """
+    Interpolates rows of a cdf given at quadratically spaced knots (see _rows) linearly at times
+    u, or, if integrate, its exact integral, which keeps averages over small st0 consistent. Both
+    are zero before 0, the cdf stays at its last value beyond the last knot.
+    """
+
+    span = knots[:, -1:]
+    clipped = np.clip(u, 0.0, span)
+    lower = np.minimum((np.sqrt(clipped / span) * (TABLE_TIMES - 1)).astype(int), TABLE_TIMES - 2)
+    lowerTime = np.take_along_axis(knots, lower, axis=1)
+    below = np.take_along_axis(cdf, lower, axis=1)
+    slope = (np.take_along_axis(cdf, lower + 1, axis=1) - below) / \
+        (np.take_along_axis(knots, lower + 1, axis=1) - lowerTime)
+    offset = clipped - lowerTime
+    if integrate:
+        value = np.take_along_axis(integral, lower, axis=1) + below * offset + 0.5 * slope * offset * offset
+        value = value + (below + slope * offset) * np.maximum(u - span, 0.0)
+    else:
+        value = below + slope * offset
+    return np.where(u > 0, value, 0.0)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+
+"""Name of the manifest file stored in each session directory."""
+MANIFEST_NAME = '.manifest.jsonl'
+
+
+class FastDmManifest:
+
+    def __init__(self, sessionDir):
+        """
+        Creates a manifest of finished data sets for the given session directory.
+        Each finished data set is appended as one json line, so a crash can at
+        most lose the line which was written at that very moment.
+        """
+
+        self._fileName = sessionDir + '/' + MANIFEST_NAME
+        self.entries = {}
+        self._load()
+
+    def _load(self):
+        """Reads all entries recorded so far, later entries overwrite earlier ones."""
+
+        if not os.path.isfile(self._fileName):
+            return
+
+        with open(self._fileName, 'r') as manifestFile:
+            for line in manifestFile:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['dataset']] = entry
+                except (ValueError, KeyError):
+                    # Line was only partially written (e.g. crash), ignore it
+                    pass
+
+    def isFinished(self, dataset, dataHash, templateHash):
+        """Checks if data set has been estimated with identical data and control template."""
+
+        entry = self.entries.get(dataset)
+        return entry is not None and \
+            entry['data'] == dataHash and \
+            entry['template'] == templateHash
+
+    def hasStage(self, dataset, stage):
+        """Checks if a stage following the estimate of a data set (e.g. cdf) has been finished since."""
+
+        entry = self.entries.get(dataset)
+        return entry is not None and stage in entry.get('stages', [])
+
+    def record(self, dataset, dataHash, templateHash):
+        """Appends a finished data set to the manifest file, stages recorded before are void."""
+
+        self._append({'dataset': dataset, 'data': dataHash, 'template': templateHash})
+
+    def recordStage(self, dataset, stage):
+        """Appends a finished stage of a data set, whose estimate has been recorded before."""
+
+        entry = dict(self.entries[dataset])
+        entry['stages'] = sorted(set(entry.get('stages', [])) | {stage})
+        self._append(entry)
+
+    def _append(self, entry):
+        """Appends an entry to the manifest file, it replaces earlier entries of its data set."""
+
+        self.entries[entry['dataset']] = entry
+        with open(self._fileName, 'a') as manifestFile:
+            manifestFile.write(json.dumps(entry) + '\n')
+            manifestFile.flush()
+
+
+def hashFile(fileName):
+    """Returns the sha1 hex digest of the contents of a file."""
+
+    sha = hashlib.sha1()
+    with open(fileName, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hashText(text):
+    """Returns the sha1 hex digest of a string."""
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
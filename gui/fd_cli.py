@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+Headless batch runner for servers without a display. Runs the same
+estimation -> simulation pipeline as the GUI (cdfs and densities of each
+data set are calculated during the estimation, see FastDmPipeline), but
+does not import PyQt. Progress is printed to stdout as one json object per line.
+
+Examples:
+    python fd_cli.py --session study.fast data/*.dat
+    python fd_cli.py --spec spec.json --output results --name run1 data/*.dat
+"""
+
+import argparse
+import json
+import pickle
+import signal
+import sys
+from fd_model import FastDmModel
+from fd_engine import FastDmEstimation, FastDmSimulation, \
+    modelProblem, simulationProblem
+
+
+def emit(event, **fields):
+    """Prints a machine-readable event as a single json line."""
+
+    fields['event'] = event
+    print(json.dumps(fields), flush=True)
+
+
+def loadModel(sessionFile, specFile):
+    """Creates a model from a saved session and/or a json spec file (spec wins)."""
+
+    model = FastDmModel()
+
+    # Load saved session (pickled model as saved by the GUI)
+    if sessionFile:
+        with open(sessionFile, 'rb') as infile:
+            model.overwrite(pickle.load(infile))
+
+    # Apply spec file, a json object with the same groups as the model
+    if specFile:
+        with open(specFile, 'r') as infile:
+            spec = json.load(infile)
+        for key, entry in spec.get('parameters', {}).items():
+            model.parameters[key].update(entry)
+        for group in ('computation', 'session', 'save', 'simParameters', 'simOptions'):
+            getattr(model, group).update(spec.get(group, {}))
+
+    return model
+
+
+def readHeader(fileName):
+    """Returns the column names of a data file, which has to start with a # header."""
+
+    with open(fileName, 'r') as infile:
+        firstLine = infile.readline()
+    if not firstLine.startswith('#'):
+        raise ValueError("No header was found in {}. The first row has to start with '#'.".format(fileName))
+    return firstLine.replace('#', ' ', 1).split()
+
+
+def setDataFiles(model, files):
+    """Sets data files and determines column indices of RESPONSE and TIME from their headers."""
+
+    # Check that all files share the same header
+    columns = readHeader(files[0])
+    for fileName in files[1:]:
+        if readHeader(fileName) != columns:
+            raise ValueError('Header of {} does not match header of previous file(s).'.format(fileName))
+
+    model.session['datafiles'] = files
+    model.session['columns'] = columns
+
+    # Resolve response and time columns by name, default to columns called so
+    for key in ('RESPONSE', 'TIME'):
+        name = model.session[key]['name'] or key
+        if name not in columns:
+            raise ValueError('Column {} not found in header of data files.'.format(name))
+        model.session[key] = {'idx': columns.index(name), 'name': name}
+
+
+def parseArgs(argv):
+    """Parses command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Runs fast-dm without the graphical user interface.')
+    parser.add_argument('datafiles', nargs='*', help='data files (default: data files of the session)')
+    parser.add_argument('--session', help='session file (*.fast) saved by the GUI')
+    parser.add_argument('--spec', help='json file with model settings, overrides the session')
+    parser.add_argument('--output', help='output location')
+    parser.add_argument('--name', help='directory name of the session')
+    parser.add_argument('--jobs', type=int, help='number of data sets estimated in parallel')
+    parser.add_argument('--coordinator', metavar='HOST:PORT',
+                        help='hand out data sets to workers (fd_distributed.py) connecting to this address')
+    parser.add_argument('--backend', choices=['fastdm', 'native'],
+                        help='estimate with the fast-dm executable or natively in python')
+    parser.add_argument('--batch-size', type=int,
+                        help='number of data sets the native backend estimates together in lockstep')
+    parser.add_argument('--cdf-table', action='store_true',
+                        help='native ks and cs interpolate cdfs from a precomputed lookup table')
+    parser.add_argument('--starts', type=int,
+                        help='number of optimizations the native backend runs per data set, the best is kept')
+    parser.add_argument('--timeout', type=int, help='seconds after which a single data set is given up (0: no limit)')
+    parser.add_argument('--retries', type=int, help='number of times a failed data set is estimated again')
+    parser.add_argument('--npz', action='store_true',
+                        help='also store all estimates as a columnar numpy archive (estimates_all.npz)')
+    parser.add_argument('--no-cdf', action='store_true', help='do not calculate cdfs')
+    parser.add_argument('--no-density', action='store_true', help='do not calculate densities')
+    parser.add_argument('--simulate', action='store_true', help='also run the simulation settings')
+    parser.add_argument('--seed', type=int, help='seed of the simulation, the same seed gives the same data sets')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Runs the pipeline, returns the exit code."""
+
+    args = parseArgs(argv)
+
+    # ===== Create model ===== #
+    try:
+        model = loadModel(args.session, args.spec)
+        if args.output:
+            model.session['outputdir'] = args.output
+        if args.name:
+            model.session['sessionname'] = args.name
+        if args.jobs:
+            model.computation['jobs'] = args.jobs
+        if args.coordinator:
+            model.computation['coordinator'] = args.coordinator
+        if args.backend:
+            model.computation['backend'] = args.backend
+        if args.batch_size:
+            model.computation['batchsize'] = args.batch_size
+        if args.cdf_table:
+            model.computation['cdftable'] = True
+        if args.starts:
+            model.computation['starts'] = args.starts
+        if args.timeout is not None:
+            model.computation['timeout'] = args.timeout
+        if args.retries is not None:
+            model.computation['retries'] = args.retries
+        if args.npz:
+            model.save['npz'] = True
+        if args.seed is not None:
+            model.simOptions['seed'] = args.seed
+        if args.no_cdf:
+            model.save['cdf'] = False
+        if args.no_density:
+            model.save['dens'] = False
+        setDataFiles(model, args.datafiles or model.session['datafiles'])
+    except (OSError, ValueError, KeyError, IndexError, pickle.UnpicklingError) as e:
+        emit('error', stage='setup', message=str(e))
+        return 2
+
+    problem = modelProblem(model)
+    if problem is not None:
+        emit('error', stage='setup', message=problem)
+        return 2
+
+    # ===== Abort gracefully on Ctrl+C ===== #
+    flag = {'run': False}
+    running = []
+
+    def onInterrupt(signum, frame):
+        flag['run'] = False
+        for stage in running:
+            stage.abort()
+
+    signal.signal(signal.SIGINT, onInterrupt)
+
+    # ===== Estimation ===== #
+    total = len(model.session['datafiles'])
+    emit('started', stage='estimation', total=total)
+    estimation = FastDmEstimation(model, flag,
+                                  log=lambda txt: emit('log', stage='estimation', message=txt),
+                                  progress=lambda done: emit('progress', stage='estimation',
+                                                             done=done, total=total))
+    running.append(estimation)
+    estimation.run()
+    running.remove(estimation)
+
+    if estimation.aborted:
+        emit('aborted', stage='estimation')
+        return 130
+    for name, attempts, reason in estimation.failures:
+        emit('failed', stage='estimation', dataset=name, attempts=attempts, message=reason)
+
+    if estimation.error:
+        emit('error', stage='estimation', message='Estimation aborted due to error')
+        return 1
+
+    if model.save['ctl']:
+        emit('log', stage='estimation', message='Control file saved as ' + estimation.saveFileTemplate())
+    emit('finished', stage='estimation',
+         directory=model.session['outputdir'] + '/' + model.session['sessionname'])
+
+    # ===== Simulation ===== #
+    if args.simulate:
+        problem = simulationProblem(model)
+        if problem is not None:
+            emit('error', stage='simulation', message=problem)
+            return 2
+        emit('started', stage='simulation', total=model.simOptions['nsamples'])
+        simulation = FastDmSimulation(model, flag,
+                                      log=lambda txt: emit('log', stage='simulation', message=txt),
+                                      progress=lambda done: emit('progress', stage='simulation', done=done,
+                                                                 total=model.simOptions['nsamples']))
+        running.append(simulation)
+        simulation.run()
+        running.remove(simulation)
+        if simulation.aborted:
+            emit('aborted', stage='simulation')
+            return 130
+        emit('finished', stage='simulation')
+
+    # Partial success, some data sets could not be estimated
+    if estimation.failures:
+        return 3
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
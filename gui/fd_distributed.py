@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+
+"""
+Distributed estimation over a local network. A coordinator pool hands out
+fast-dm jobs to any number of workers connected over TCP, and workers on this
+or other hosts pull jobs, run fast-dm locally and send the estimates back.
+Messages are json objects, one per line.
+
+Start a worker with 4 slots connecting to a coordinator on host 10.0.0.1:
+    python fd_distributed.py 10.0.0.1:5555 --jobs 4
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from fd_model import FastDmModel
+from fd_process_pool import RETRY
+
+
+"""Seconds between two heartbeats of a worker running a job."""
+HEARTBEAT_INTERVAL = 5.0
+
+"""Seconds without a heartbeat after which a job is handed out again."""
+LEASE_TIMEOUT = 30.0
+
+"""Maximum time (seconds) the coordinator sleeps without checking the run flag and leases."""
+ABORT_LATENCY = 0.1
+
+"""Event types posted to the coordinator's event queue."""
+OUTPUT = 'output'
+EXITED = 'exited'
+ABORTED = 'aborted'
+FAILED = 'failed'
+
+
+class FastDmCoordinatorPool:
+
+    def __init__(self, address, flag, timeout=None, leaseTimeout=LEASE_TIMEOUT):
+        """
+        Creates a new coordinator listening on address ('host:port'). Has the
+        same interface as FastDmProcessPool, but jobs are run by remote workers.
+        Jobs not finished timeout seconds (if given) after handing them out are
+        reported as failed.
+        """
+
+        host, port = address.rsplit(':', 1)
+        self._address = (host, int(port))
+        self._flag = flag
+        self._timeout = timeout
+        self._leaseTimeout = leaseTimeout
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._exhausted = False
+        # Jobs handed back by lost workers, served before new ones
+        self._requeued = collections.deque()
+        # Jobs handed out as key -> [job, connection id, lease deadline, time handed out, token]
+        self._leased = {}
+        # Distinguishes results of a job from those of earlier hand-outs of the same key
+        self._tokens = itertools.count()
+        # Handlers of connected workers as connection id -> handler, to cancel their jobs
+        self._connections = {}
+        # Arguments of all jobs taken from the iterable as key -> args
+        self._args = {}
+        # Keys of all jobs taken from the iterable, but not yet reported as finished
+        self._open = set()
+        self.aborted = False
+
+    def run(self, jobs, onFinished, onOutput=None):
+        """
+        Serves all jobs given as an iterable of (key, [fastdm, control file]) pairs
+        to the workers. Calls onOutput(key, line) for each line a worker reports
+        and onFinished(key, returncode, log) after the estimates were written.
+        The returncode is None, if the job has exceeded the timeout.
+        If onFinished returns RETRY, the job is handed out once more,
+        if it returns False, the remaining jobs are dropped.
+        Returns True if all jobs were run, False if aborted or stopped.
+        Errors raised by the iterable stop the run and are raised again.
+        """
+
+        self._jobs = iter(jobs)
+        self._exhausted = False
+        logs = collections.defaultdict(list)
+
+        # Start server, each worker connection is handled in its own thread
+        server = _FastDmServer(self._address, _FastDmRequestHandler)
+        server.pool = self
+        serverThread = threading.Thread(target=server.serve_forever, daemon=True)
+        serverThread.start()
+
+        try:
+            while True:
+
+                # Nothing left to do
+                if self.allDone():
+                    return True
+
+                # Sleep until something happens (or the abort latency has passed)
+                try:
+                    event, key, payload = self._events.get(timeout=ABORT_LATENCY)
+                except queue.Empty:
+                    event = None
+
+                # Check if user has aborted, either by event or by flag
+                if event == ABORTED or not self._flag['run']:
+                    self.aborted = True
+                    return False
+
+                # Jobs could not be generated, the remaining data sets would be lost silently
+                if event == FAILED:
+                    raise payload
+
+                # Hand out jobs of silent workers again
+                self._checkLeases()
+
+                # Handle a new line of output, collect it for the final log
+                if event == OUTPUT:
+                    logs[key].append(payload)
+                    if onOutput is not None:
+                        onOutput(key, payload)
+
+                # Handle a finished job, estimates are already written
+                elif event == EXITED:
+                    decision = onFinished(key, payload, '\n'.join(logs.pop(key, [])))
+                    if decision is False:
+                        return False
+                    with self._lock:
+                        if decision == RETRY:
+                            self._requeued.append((key, self._args[key]))
+                        else:
+                            self._open.discard(key)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def abort(self):
+        """Requests an abort. Thread-safe, wakes up the coordinator immediately."""
+
+        self._events.put((ABORTED, None, None))
+
+    def nextJob(self, connection):
+        """
+        Called from a connection thread, returns a job message for the worker,
+        None if all jobs are handed out but some are still running.
+        """
+
+        with self._lock:
+            if self._requeued:
+                key, args = self._requeued.popleft()
+            elif not self._exhausted:
+                try:
+                    key, args = next(self._jobs)
+                except StopIteration:
+                    self._exhausted = True
+                    return None
+                except Exception as e:
+                    # Not the worker's fault, the coordinator stops the run with the error
+                    self._exhausted = True
+                    self._events.put((FAILED, None, e))
+                    return None
+                self._open.add(key)
+                self._args[key] = args
+            else:
+                return None
+            now = time.time()
+            token = next(self._tokens)
+            self._leased[key] = [(key, args), connection, now + self._leaseTimeout, now, token]
+
+        # Read control and data file, the worker rewrites load and save lines
+        try:
+            with open(args[1], 'r') as controlFile:
+                control = controlFile.read()
+            with open(re.search(r'^load "(.*)"$', control, re.M).group(1), 'r') as dataFile:
+                data = dataFile.read()
+        except (OSError, AttributeError) as e:
+            # Job cannot be handed out, report it as failed instead of blaming the worker
+            with self._lock:
+                self._leased.pop(key, None)
+            self._events.put((OUTPUT, key, 'error: could not read job files: {}'.format(e)))
+            self._events.put((EXITED, key, 1))
+            return None
+        return {'type': 'job', 'key': key, 'token': token, 'control': control, 'data': data}
+
+    def allDone(self):
+        """Called from a connection thread, True if no job is left at all."""
+
+        with self._lock:
+            return self._exhausted and not self._open
+
+    def heartbeat(self, connection):
+        """Called from a connection thread, extends the leases of the connection's jobs."""
+
+        with self._lock:
+            for lease in self._leased.values():
+                if lease[1] == connection:
+                    lease[2] = time.time() + self._leaseTimeout
+
+    def connect(self, connection, handler):
+        """Called from a connection thread when a worker connects."""
+
+        with self._lock:
+            self._connections[connection] = handler
+
+    def output(self, key, token, line):
+        """Called from a connection thread for each line a worker reports, lines of stale jobs are ignored."""
+
+        with self._lock:
+            lease = self._leased.get(key)
+            if lease is None or lease[4] != token:
+                return
+        self._events.put((OUTPUT, key, line))
+
+    def result(self, connection, key, token, returncode, parameters):
+        """Called from a connection thread, writes the estimates of a finished job."""
+
+        with self._lock:
+            lease = self._leased.get(key)
+            # Lease has expired (and was cancelled), the job is handed out again
+            if lease is None or lease[1] != connection or lease[4] != token:
+                return
+            job = self._leased.pop(key)[0]
+
+        # Write estimates where fast-dm would have saved them
+        if parameters is not None:
+            with open(job[1][1], 'r') as controlFile:
+                saveFileName = re.search(r'^save "(.*)"$', controlFile.read(), re.M).group(1)
+            with open(saveFileName, 'w') as saveFile:
+                saveFile.write(parameters)
+        self._events.put((EXITED, key, returncode))
+
+    def lost(self, connection):
+        """Called from a connection thread when a worker disconnects, requeues its jobs."""
+
+        with self._lock:
+            self._connections.pop(connection, None)
+            for key in [key for key, lease in self._leased.items() if lease[1] == connection]:
+                self._requeued.append(self._leased.pop(key)[0])
+
+    def _checkLeases(self):
+        """
+        Requeues all jobs whose worker has not sent a heartbeat for too long,
+        and reports jobs running longer than the timeout as failed. Workers
+        are told to cancel such jobs, so a data set does not run twice.
+        """
+
+        now = time.time()
+        cancelled = []
+        with self._lock:
+            for key in [key for key, lease in self._leased.items() if lease[2] < now]:
+                cancelled.append(self._leased[key])
+                self._requeued.append(self._leased.pop(key)[0])
+            if self._timeout:
+                for key in [key for key, lease in self._leased.items() if now - lease[3] > self._timeout]:
+                    cancelled.append(self._leased.pop(key))
+                    self._events.put((EXITED, key, None))
+            handlers = [(self._connections.get(lease[1]), lease) for lease in cancelled]
+
+        # Send outside the lock, a silent worker may block
+        for handler, lease in handlers:
+            if handler is not None:
+                handler.cancel(lease[0][0], lease[4])
+
+
+class _FastDmServer(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _FastDmRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        """Serves a single worker connection until it closes."""
+
+        pool = self.server.pool
+        connection = id(self)
+        # Replies and cancels are sent from different threads
+        self._lock = threading.Lock()
+        pool.connect(connection, self)
+        try:
+            for line in self.rfile:
+                message = json.loads(line.decode('utf-8'))
+
+                if message['type'] == 'request':
+                    # Hand out a job, tell worker to wait or to quit
+                    job = pool.nextJob(connection)
+                    if job is None:
+                        job = {'type': 'done' if pool.allDone() else 'wait'}
+                    self._send(job)
+                elif message['type'] == 'heartbeat':
+                    pool.heartbeat(connection)
+                elif message['type'] == 'output':
+                    pool.output(message['key'], message['token'], message['line'])
+                elif message['type'] == 'result':
+                    pool.result(connection, message['key'], message['token'],
+                                message['returncode'], message['parameters'])
+        except (OSError, ValueError, KeyError):
+            # Broken connection or message, treat worker as lost
+            pass
+        finally:
+            pool.lost(connection)
+
+    def cancel(self, key, token):
+        """Called from the coordinator thread, tells the worker to stop a job handed out again."""
+
+        try:
+            self._send({'type': 'cancel', 'key': key, 'token': token})
+        except (OSError, ValueError):
+            # Worker gone, its connection thread cleans up
+            pass
+
+    def _send(self, message):
+        """Sends a single message to the worker (thread-safe)."""
+
+        with self._lock:
+            self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class FastDmWorker:
+
+    def __init__(self, address, fastdm):
+        """Creates a worker with a single slot, which pulls jobs from the coordinator at address."""
+
+        host, port = address.rsplit(':', 1)
+        self._address = (host, int(port))
+        self._fastdm = fastdm
+        self._lock = threading.Lock()
+        self._socket = None
+        # Messages of the coordinator other than cancels, None once the connection is lost
+        self._messages = queue.Queue()
+        # Running job as [token, fast-dm process, cancelled], guarded by its own lock
+        self._running = None
+        self._runningLock = threading.Lock()
+
+    def run(self):
+        """Pulls and runs jobs until the coordinator has no more jobs or the connection is lost."""
+
+        self._socket = socket.create_connection(self._address)
+        reader = self._socket.makefile('rb')
+        # Cancels must arrive while a job runs, so a thread reads all messages
+        threading.Thread(target=self._read, args=(reader,), daemon=True).start()
+        try:
+            while True:
+                self._send({'type': 'request'})
+                message = self._messages.get()
+                if message is None:
+                    return
+
+                if message['type'] == 'done':
+                    return
+                elif message['type'] == 'wait':
+                    # Other workers still run the last jobs, they may be lost
+                    time.sleep(HEARTBEAT_INTERVAL)
+                else:
+                    self._runJob(message)
+        except OSError:
+            # Coordinator gone
+            pass
+        finally:
+            reader.close()
+            self._socket.close()
+
+    def _runJob(self, job):
+        """Runs fast-dm on a job in a temporary directory and sends back the estimates."""
+
+        workDir = tempfile.mkdtemp()
+        try:
+            dataFileName = workDir + '/data.dat'
+            saveFileName = workDir + '/parameters.dat'
+            controlFileName = workDir + '/job.ctl'
+
+            # Write data and control file pointing to local files
+            with open(dataFileName, 'w') as dataFile:
+                dataFile.write(job['data'])
+            control = re.sub(r'^load ".*"$', lambda m: 'load "{}"'.format(dataFileName), job['control'], flags=re.M)
+            control = re.sub(r'^save ".*"$', lambda m: 'save "{}"'.format(saveFileName), control, flags=re.M)
+            with open(controlFileName, 'w') as controlFile:
+                controlFile.write(control)
+
+            # Run fast-dm and keep the coordinator informed while it runs
+            p = subprocess.Popen([self._fastdm, controlFileName],
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            with self._runningLock:
+                self._running = [job['token'], p, False]
+            finished = threading.Event()
+            beater = threading.Thread(target=self._beat, args=(finished,), daemon=True)
+            beater.start()
+            try:
+                for line in p.stdout:
+                    self._send({'type': 'output', 'key': job['key'], 'token': job['token'],
+                                'line': line.decode('utf-8', 'replace').rstrip('\r\n')})
+                returncode = p.wait()
+            finally:
+                finished.set()
+                with self._runningLock:
+                    cancelled = self._running[2]
+                    self._running = None
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+
+            # Job was handed out again, the coordinator ignores its result anyway
+            if cancelled:
+                return
+
+            # Send back estimates, if fast-dm wrote any
+            parameters = None
+            if os.path.isfile(saveFileName):
+                with open(saveFileName, 'r') as saveFile:
+                    parameters = saveFile.read()
+            self._send({'type': 'result', 'key': job['key'], 'token': job['token'],
+                        'returncode': returncode, 'parameters': parameters})
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    def _read(self, reader):
+        """Run in a thread, kills the running job on a cancel and queues all other messages."""
+
+        try:
+            for line in reader:
+                message = json.loads(line.decode('utf-8'))
+                if message['type'] == 'cancel':
+                    self._cancel(message['token'])
+                else:
+                    self._messages.put(message)
+        except (OSError, ValueError):
+            # Coordinator gone or connection closed
+            pass
+        finally:
+            self._messages.put(None)
+
+    def _cancel(self, token):
+        """Kills the fast-dm process of the running job, if it is the one with token."""
+
+        with self._runningLock:
+            if self._running is not None and self._running[0] == token:
+                self._running[2] = True
+                self._running[1].kill()
+
+    def _beat(self, finished):
+        """Run in a thread, sends heartbeats until the job has finished."""
+
+        while not finished.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._send({'type': 'heartbeat'})
+            except OSError:
+                return
+
+    def _send(self, message):
+        """Sends a single message to the coordinator (thread-safe)."""
+
+        with self._lock:
+            self._socket.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def main(argv=None):
+    """Starts a number of single slot workers and waits until all of them are done."""
+
+    parser = argparse.ArgumentParser(description='Runs fast-dm jobs handed out by a coordinator.')
+    parser.add_argument('address', help='address of the coordinator as host:port')
+    parser.add_argument('--jobs', type=int, default=1, help='number of jobs run in parallel')
+    parser.add_argument('--fastdm', default=FastDmModel().session['fastdmpath'],
+                        help='path to the fast-dm executable on this host')
+    args = parser.parse_args(argv)
+
+    workers = [threading.Thread(target=FastDmWorker(args.address, args.fastdm).run)
+               for _ in range(args.jobs)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
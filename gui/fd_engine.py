@@ -0,0 +1,1091 @@
+from fd_cdf_stats import ECDF
+from fd_cache import FastDmEstimateCache
+from fd_cdf_table import buildCdfTable, cdfTableFileName
+from fd_checkpoint import FastDmManifest, hashFile, hashText
+from fd_distributed import FastDmCoordinatorPool
+from fd_estimates import FastDmEstimateTable
+from fd_estimator import estimateFile, estimateFiles, statisticsKey
+from fd_pipeline import FastDmPipeline
+from fd_process_pool import FastDmProcessPool, FastDmTaskPool, RETRY
+from fd_scheduler import FastDmTimings, countTrials, longestFirst
+from fd_simulator import simulateDiffusion
+from fd_wiener import wienerCdf, wienerDensity
+import numpy as np
+import glob
+import json
+import os
+import time
+
+
+"""Global variables indicating end directory names."""
+PARAMETERSDIR = 'individual_estimates'
+CDFDIR = 'cdf'
+DENSITYDIR = 'density'
+ALL_ESTIMATES_NAME = 'estimates_all.csv'
+ALL_ESTIMATES_BINARY_NAME = 'estimates_all.npz'
+FAILURES_NAME = 'failures.csv'
+STATISTICSDIR = 'statistics'
+
+"""Number of points of each predicted cdf."""
+CDF_POINTS = 1000
+
+"""Predicted cdfs and densities extend beyond the slowest response of a data set by this factor."""
+CDF_MARGIN = 1.2
+
+"""Number of bins of each empirical density (over both responses)."""
+DENSITY_BINS = 50
+
+"""Suffix of the binary bundle of all curves in a cdf (or density) directory, e.g. cdf/cdf_bundle.npy."""
+BUNDLE_SUFFIX = '_bundle'
+
+"""Maximum number of trials simulated at once, between two checks for an abort."""
+SIMULATION_CHUNK_TRIALS = 200000
+
+
+class FastDmEstimation:
+
+    def __init__(self, model, flag, log=None, progress=None):
+        """
+        Creates a new estimation which will run fast-dm in a parallel
+        manner according to the num CPUs specified. Assumes that the model
+        has valid parameter specifications. Log lines are passed to log(str),
+        the number of finished data sets to progress(int).
+        """
+
+        self._model = model
+        self._flag = flag
+        self._log = log if log is not None else _discard
+        self._progress = progress if progress is not None else _discard
+        self.controlFileTemplate = None
+        self.aborted = False
+        self.error = False
+        self.failures = []
+        self._pool = None
+        self._cdfTableFileName = None
+        self._statisticsFileNames = []
+        self._calculations = []
+
+    def run(self):
+        """
+        Runs fast-dm estimation, blocks until finished or aborted. Sets error, if the run
+        was stopped by a file that could not be read or written, or no data set could be
+        estimated at all.
+        """
+
+        # Modify flag
+        self._flag['run'] = True
+        try:
+            self._runBinary()
+        except OSError as e:
+            self.error = True
+            self._log('Estimation stopped: {}'.format(e))
+            return
+
+        # Every data set failed, e.g. fast-dm does not work or the data format is wrong
+        if not self.aborted and self.failures and len(self.failures) == len(self._model.session['datafiles']):
+            self.error = True
+
+    def _runBinary(self):
+        """Runs instances of fast-dm from a pool, a new one as soon as a slot is free."""
+
+        # Get file contents as string with two {} placeholders
+        self.controlFileTemplate = self._getFileTemplate()
+
+        # Overwrite session dir so no clash occurs, unless a previous run is resumed
+        if not self._model.computation['resume']:
+            self._model.session['sessionname'] = self._sessionDir(self._model.session['sessionname'])
+
+        # Shorten some variable names
+        files = self._model.session['datafiles']
+        sessionPath = self._model.session['outputdir'] + '/' + \
+                      self._model.session['sessionname']
+        path = sessionPath + '/' + PARAMETERSDIR + '/'
+        allEstimatesFileName = sessionPath + '/' + ALL_ESTIMATES_NAME
+        allEstimatesBinaryFileName = sessionPath + '/' + ALL_ESTIMATES_BINARY_NAME \
+            if self._model.save['npz'] else None
+        failuresFileName = sessionPath + '/' + FAILURES_NAME
+
+        # Create path, if it does not exist
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # Load manifest of finished data sets and hash current data and template
+        manifest = FastDmManifest(sessionPath)
+        templateHash = hashText(self.controlFileTemplate)
+        # Estimates of the native backend differ slightly from fast-dm's, keep them apart
+        if self._native():
+            templateHash = hashText(self.controlFileTemplate + 'backend native\n')
+
+        # Native ks and cs may interpolate cdfs from a lookup table shared by all sessions
+        self._cdfTableFileName = None
+        if self._native() and self._model.computation['cdftable'] and self._model.computation['method'] != 'ml':
+            self._cdfTableFileName = cdfTableFileName(self._model.session['cachedir'])
+            templateHash = hashText(self.controlFileTemplate + 'backend native\ncdftable\n')
+        # Best of several starts differs from a single one as well
+        if self._native() and self._model.computation['starts'] > 1:
+            templateHash = hashText(templateHash + 'starts {}\n'.format(self._model.computation['starts']))
+        dataHashes = [hashFile(file) for file in files]
+
+        # Native cs estimates from quantile bins of each data set, computed once and shared by all sessions
+        self._statisticsFileNames = [None] * len(files)
+        if self._native() and self._model.computation['method'] == 'cs':
+            statisticsDir = self._model.session['cachedir'] + '/' + STATISTICSDIR
+            os.makedirs(statisticsDir, exist_ok=True)
+            self._statisticsFileNames = [statisticsDir + '/' + statisticsKey(dataHash, self._nativeSettings()) + '.json'
+                                         for dataHash in dataHashes]
+
+        # Determine data sets finished by a previous run (only if resuming)
+        done = set()
+        if self._model.computation['resume']:
+            for idx, file in enumerate(files):
+                name = file.split('/')[-1]
+                if manifest.isFinished(name, dataHashes[idx], templateHash) and \
+                        os.path.isfile(path + 'parameters_' + name):
+                    done.add(idx)
+
+        # Open estimate cache shared by all sessions, if specified
+        cache = None
+        if self._model.computation['cache']:
+            cache = FastDmEstimateCache(self._model.session['cachedir'],
+                                        self._model.computation['cachesize'] * 1024 * 1024)
+        cacheKeys = [FastDmEstimateCache.key(dataHash, templateHash,
+                                             self._model.computation['method'],
+                                             self._model.computation['precision'])
+                     for dataHash in dataHashes]
+
+        # Dispatch most expensive data sets first (estimated from trials and past timings)
+        method = self._model.computation['method']
+        precision = self._model.computation['precision']
+        # Timings live in the shared cache directory, only touch it if cache or scheduling is enabled
+        timings = None
+        if self._model.computation['cache'] or self._model.computation['longestfirst']:
+            timings = FastDmTimings(self._model.session['cachedir'], 'native' if self._native() else 'fastdm')
+        trials = [countTrials(file) for file in files]
+        if self._model.computation['longestfirst']:
+            order = longestFirst(trials, method, precision, timings)
+        else:
+            order = list(range(len(files)))
+        # Start times of dispatched data sets
+        started = {}
+        # Number of runs of each data set, failed ones are retried as specified
+        attempts = [0] * len(files)
+
+        # Remove failures report of a previous (resumed) run
+        if os.path.isfile(failuresFileName):
+            os.remove(failuresFileName)
+
+        # Number of finished data sets (for the progress bar)
+        nFinished = [0]
+
+        def aggregate(idx):
+            """Adds estimates of data set idx to the common table, returns False on failure."""
+
+            # Different files may differ in order and set of estimated parameters
+            # (e.g. depends), the table's columns are the union of all headers
+            try:
+                name = files[idx].split('/')[-1]
+                h2v, currentHeader = self._parseSingleFile(path, 'parameters_', name)
+                allEstimates.add(name, h2v, currentHeader)
+            except FileNotFoundError as e:
+                # Catch problem, if any with fast-dm failing
+                return False
+
+            # Update progress bar
+            nFinished[0] += 1
+            self._progress(nFinished[0])
+            return True
+
+        def fail(idx, reason):
+            """Records a data set which could not be estimated, the run goes on without it."""
+
+            self.failures.append((files[idx].split('/')[-1], attempts[idx], reason))
+            self._log('[{}] Estimation failed: {}'.format(files[idx].split('/')[-1], reason))
+
+            # Rewrite report, so it is complete even if the run crashes
+            with open(failuresFileName, 'w') as failuresFile:
+                failuresFile.write('dataset;attempts;reason\n')
+                for failure in self.failures:
+                    failuresFile.write('{};{};{}\n'.format(*failure))
+
+            # Update progress bar (failed data sets are done as well)
+            nFinished[0] += 1
+            self._progress(nFinished[0])
+
+            # Drop the following stages of the data set
+            pipeline.fail(('estimate', idx))
+
+        def succeed(idx, elapsed):
+            """Records a data set whose estimates were aggregated."""
+
+            # Mark as finished, so a resumed run can skip it
+            manifest.record(files[idx].split('/')[-1], dataHashes[idx], templateHash)
+
+            # Record fit time, so later runs can schedule more accurately
+            if timings is not None:
+                timings.record(method, precision, trials[idx], elapsed)
+
+            # Store estimates, so later sessions need not run the same data set again
+            if cache is not None:
+                cache.put(cacheKeys[idx], path + 'parameters_' + files[idx].split('/')[-1])
+
+            # Start the following stages of the data set
+            pipeline.done(('estimate', idx))
+
+        def onOutput(idx, line):
+            """Called by the pool for each line fast-dm writes, tags it with the data set."""
+
+            # Stages following an estimate log on their own
+            if idx in pipeline:
+                return pipeline.onOutput(idx, line)
+
+            # Lines of a batch already start with the name of their data set, others
+            # (e.g. the evaluation cache summary) concern the whole batch
+            if isinstance(idx, tuple):
+                name, _, text = line.partition(': ')
+                if text and name in [files[i].split('/')[-1] for i in idx]:
+                    self._log('[{}] {}'.format(name, text))
+                else:
+                    self._log(line)
+                return
+            self._log('[{}] {}'.format(files[idx].split('/')[-1], line))
+
+        def onFinished(idx, returncode, log):
+            """Called by the pool each time a fast-dm process exits."""
+
+            if idx in pipeline:
+                return onStageFinished(idx, returncode, log)
+            if isinstance(idx, tuple):
+                return onBatchFinished(idx, returncode, log)
+
+            attempts[idx] += 1
+
+            # Check for timeout, invalid or error, if fine aggregate estimates
+            errors = [line for line in log.splitlines()
+                      if 'invalid' in line or 'error' in line or "Not enough" in line]
+            if returncode is None:
+                reason = 'Timed out after {} seconds'.format(self._model.computation['timeout'])
+            elif errors:
+                reason = errors[0].strip()
+            elif not aggregate(idx):
+                reason = 'No estimates written'
+            else:
+                reason = None
+
+            # Retry failed data set, if any attempts are left
+            if reason is not None and attempts[idx] <= self._model.computation['retries']:
+                self._log('[{}] {}, retrying...'.format(files[idx].split('/')[-1], reason))
+                # Fit time recorded later is that of the last attempt only
+                started[idx] = time.time()
+                return RETRY
+
+            # Delete temporary control file (the native backend does not write any)
+            if os.path.isfile(path + '.controlfile_{}.ctl'.format(idx)):
+                os.remove(path + '.controlfile_{}.ctl'.format(idx))
+
+            # Give up on failed data set, but go on with the others
+            if reason is not None:
+                fail(idx, reason)
+                return
+
+            succeed(idx, time.time() - started[idx])
+
+        def onStageFinished(key, returncode, log):
+            """Called by the pool each time a stage following an estimate has finished."""
+
+            pipeline.onFinished(key, returncode, log)
+
+            # Mark as finished, so a resumed run can keep its files
+            if returncode == 0:
+                manifest.recordStage(files[key[1]].split('/')[-1], key[0])
+
+        def onBatchFinished(batch, returncode, log):
+            """Called by the pool each time a batch of data sets (native backend) is finished."""
+
+            for idx in batch:
+                attempts[idx] += 1
+            names = [files[idx].split('/')[-1] for idx in batch]
+            written = [os.path.isfile(path + 'parameters_' + name) for name in names]
+
+            # Batch timed out or crashed as a whole, retry it as a whole
+            if returncode is None or not any(written):
+                if returncode is None:
+                    reason = 'Timed out after {} seconds'.format(self._model.computation['timeout'])
+                else:
+                    reason = next((line.strip() for line in log.splitlines() if 'error' in line),
+                                  'No estimates written')
+                if attempts[batch[0]] <= self._model.computation['retries']:
+                    self._log('[{}] {}, retrying...'.format(', '.join(names), reason))
+                    started[batch] = time.time()
+                    return RETRY
+                for idx in batch:
+                    fail(idx, reason)
+                return
+
+            # Data sets the batch reported errors for are invalid, retrying would not help
+            elapsed = time.time() - started[batch]
+            nTrials = max(sum(trials[idx] for idx in batch), 1)
+            for idx, name in zip(batch, names):
+                errors = [line[len(name) + 2:] for line in log.splitlines()
+                          if line.startswith(name + ': ') and 'error' in line]
+                if errors or not aggregate(idx):
+                    fail(idx, errors[0] if errors else 'No estimates written')
+                else:
+                    succeed(idx, elapsed * trials[idx] / nTrials)
+
+        # Open table of all estimates (rewritten as a whole, since resumed runs add to it)
+        with FastDmEstimateTable(allEstimatesFileName, allEstimatesBinaryFileName) as allEstimates:
+
+            # Write out estimates of data sets finished by a previous run (run again, if unreadable)
+            for idx in sorted(done):
+                if not aggregate(idx):
+                    done.discard(idx)
+
+            if done:
+                self._log('Resuming session, skipped {} finished data set(s).'.format(len(done)))
+
+            # Stages following the estimate of each data set, run as soon as it is finished
+            pipeline = self._createPipeline(files, manifest, done)
+            for idx in sorted(done):
+                pipeline.done(('estimate', idx))
+
+            # Copy estimates of data sets already estimated in an earlier session from cache
+            if cache is not None:
+                nCached = 0
+                for idx, file in enumerate(files):
+                    name = file.split('/')[-1]
+                    if idx not in done and cache.get(cacheKeys[idx], path + 'parameters_' + name):
+                        if not aggregate(idx):
+                            continue
+                        manifest.record(name, dataHashes[idx], templateHash)
+                        pipeline.done(('estimate', idx))
+                        done.add(idx)
+                        nCached += 1
+                if nCached:
+                    self._log('Took estimates of {} data set(s) from cache.'.format(nCached))
+
+            # Build lookup table once, it is reused by all later runs
+            if self._cdfTableFileName is not None and not os.path.isfile(self._cdfTableFileName):
+                self._log('Building cdf lookup table {} ...'.format(self._cdfTableFileName))
+                os.makedirs(self._model.session['cachedir'], exist_ok=True)
+                if not buildCdfTable(self._cdfTableFileName, self._model.computation['jobs'], self._flag):
+                    self.aborted = True
+                    return
+
+            try:
+                # Run all remaining data files through the pool (blocks until done), the
+                # stages of finished data sets in between, remote workers run fast-dm only
+                self._pool = self._createPool()
+                jobs = self._jobs(path, order, done, started)
+                if not self._model.computation['coordinator']:
+                    jobs = pipeline.jobs(jobs)
+                self._pool.run(jobs, onFinished, onOutput)
+                self.aborted = self._pool.aborted
+
+                # Run stages left over (of remote estimates) locally
+                if not self.aborted and pipeline.pending():
+                    self._pool = FastDmTaskPool(self._model.computation['jobs'], self._flag,
+                                                self._model.computation['timeout'] or None)
+                    self._pool.run(pipeline.jobs(), onStageFinished, pipeline.onOutput)
+                    self.aborted = self._pool.aborted
+            finally:
+                self._pool = None
+                if timings is not None:
+                    timings.save()
+                # Remove control files of jobs killed on abort or error
+                for fileName in glob.glob(path + '.controlfile_*.ctl'):
+                    os.remove(fileName)
+
+        # Sum up failed data sets and stages
+        if self.failures:
+            self._log('{} data set(s) could not be estimated, see {}'.format(len(self.failures), failuresFileName))
+        if len(pipeline) and not self.aborted:
+            self._log(pipeline.summary())
+
+        # Bundle the curves of all data sets for the Plot tab
+        if not self.aborted:
+            for calculation in self._calculations:
+                calculation.bundle()
+
+    def _createPipeline(self, files, manifest, resumed):
+        """
+        Returns the stages following the estimate of each data set as specified by save
+        (see FastDmPipeline). Estimates are external nodes, finished by _runBinary. Stages
+        of resumed data sets, which the manifest records as finished and whose files are
+        still there, are not run again.
+        """
+
+        pipeline = FastDmPipeline(self._log)
+        stages = []
+        if self._model.save['cdf']:
+            stages.append(('cdf', FastDmCdfCalculation(self._model, self._log)))
+        if self._model.save['dens']:
+            stages.append(('density', FastDmDensityCalculation(self._model, self._log)))
+        self._calculations = [calculation for stage, calculation in stages]
+
+        nKept = 0
+        for idx, file in enumerate(files):
+            name = file.split('/')[-1]
+            pipeline.add(('estimate', idx), name=name)
+            for stage, calculation in stages:
+                if idx in resumed and manifest.hasStage(name, stage) and calculation.isWritten(idx):
+                    nKept += 1
+                    continue
+                pipeline.add((stage, idx), calculation.task((idx,)), after=[('estimate', idx)], name=name)
+        if nKept:
+            self._log('Resuming session, kept {} cdf and density file(s) of finished data sets.'.format(nKept))
+        return pipeline
+
+    def _native(self):
+        """True if data sets are estimated in python worker processes instead of fast-dm."""
+
+        return self._model.computation['backend'] == 'native' and not self._model.computation['coordinator']
+
+    def _createPool(self):
+        """
+        Returns a local process pool, a pool of python workers for the native backend
+        or, if a coordinator address is given, a pool of remote workers.
+        """
+
+        # Time limit per data set, 0 means no limit
+        timeout = self._model.computation['timeout'] or None
+
+        if self._model.computation['coordinator']:
+            self._log('Waiting for workers on ' + self._model.computation['coordinator'] + ' ...')
+            return FastDmCoordinatorPool(self._model.computation['coordinator'], self._flag, timeout)
+        if self._native():
+            return FastDmTaskPool(self._model.computation['jobs'], self._flag, timeout)
+        return FastDmProcessPool(self._model.computation['jobs'], self._flag, timeout)
+
+    def _jobs(self, path, order, skip, started):
+        """
+        Generates (index, fast-dm arguments) for each data file not in skip, in the given
+        order. The control file of a data file is written only when the pool asks for the
+        job, and the time of doing so is stored in started. With the native backend and a
+        batch size above one, keys are tuples of the indices estimated together.
+        """
+
+        # Native backend estimates batches of data sets in lockstep, if asked to
+        if self._native() and self._model.computation['batchsize'] > 1:
+            for batch in self._batches([idx for idx in order if idx not in skip]):
+                dataFileNames = [self._model.session['datafiles'][idx] for idx in batch]
+                started[batch] = time.time()
+                yield batch, (estimateFiles, (dataFileNames, [path + 'parameters_' + dataFileName.split('/')[-1]
+                                                              for dataFileName in dataFileNames],
+                                              self._nativeSettings(),
+                                              [self._statisticsFileNames[idx] for idx in batch]))
+            return
+
+        for idx in order:
+
+            # Skip data sets which are already finished
+            if idx in skip:
+                continue
+
+            # Remember when data set was dispatched
+            dataFileName = self._model.session['datafiles'][idx]
+            started[idx] = time.time()
+
+            # Native backend estimates in a worker process, no control file needed
+            if self._native():
+                yield idx, (estimateFile, (dataFileName, path + 'parameters_' + dataFileName.split('/')[-1],
+                                           self._nativeSettings(), self._statisticsFileNames[idx]))
+                continue
+
+            # Get control file name
+            controlFileName = path + '.controlfile_{}.ctl'.format(idx)
+            # Create file contents form template
+            controlFileContents = self.controlFileTemplate.format(dataFileName,
+                    path + 'parameters_' + dataFileName.split('/')[-1])
+
+            # Create control file and write out contents
+            with open(controlFileName, 'w') as controlFile:
+                controlFile.write(controlFileContents)
+
+            # Spawn fast-dm subprocess with controlFileName just created
+            yield idx, [self._model.session['fastdmpath'], controlFileName]
+
+    def _batches(self, indices):
+        """Splits data set indices into tuples of at most batch size, keeping their order."""
+
+        batchSize = self._model.computation['batchsize']
+        return [tuple(indices[start:start + batchSize]) for start in range(0, len(indices), batchSize)]
+
+    def _nativeSettings(self):
+        """Returns everything the native estimator needs to know about the model (picklable)."""
+
+        return {'parameters': self._model.parameters,
+                'method': self._model.computation['method'],
+                'precision': self._model.computation['precision'],
+                'columns': self._model.session['columns'],
+                'RESPONSE': self._model.session['RESPONSE']['idx'],
+                'TIME': self._model.session['TIME']['idx'],
+                'cdftable': self._cdfTableFileName,
+                'starts': self._model.computation['starts']}
+
+    def _getFileTemplate(self):
+        """Returns a template for generating control files."""
+
+        template = ""
+
+        # ===== Add method AND precision ===== #
+        template += 'method' + ' ' + self._model.computation['method'] + '\n'
+        template += 'precision' + ' ' + str(self._model.computation['precision']) + '\n'
+
+        # ===== Add model parameters ===== #
+        for key, entry in self._model.parameters.items():
+            if entry['fix']:
+                template += 'set' + ' ' + key + ' ' + str(entry['val']) + '\n'
+
+        # ===== Add depends ===== #
+        for key, entry in self._model.parameters.items():
+            if entry['depends']:
+                template += 'depends' + ' ' + key + ' ' + ' '.join(entry['depends']) + '\n'
+
+        # ===== Add format ===== #
+        formatLine = 'format'
+        # Loop through column names and indices
+        for idx, column in enumerate(self._model.session['columns']):
+
+            if idx == self._model.session['RESPONSE']['idx']:
+                # Found index of response
+                formatLine += ' ' + 'RESPONSE'
+            elif idx == self._model.session['TIME']['idx']:
+                # Found index of time
+                formatLine += ' ' + 'TIME'
+            else:
+                # Found other column
+                if column == 'RESPONSE' or column == 'TIME':
+                    # If the var is RESPONSE or TIME, then another var was specified
+                    # as response or time, so we rename the current.
+                    column = column + '_old'
+                formatLine += ' ' + column
+        # Add to template
+        template += formatLine + '\n'
+
+        # ===== Add Load ===== #
+        template += 'load "{}"\n'
+
+        # ===== Add Save ===== #
+        template += 'save "{}"\n'
+
+        return template
+
+    def _sessionDir(self, sessionName):
+        """Checks if directory exists, if exists, changes name so it matches."""
+
+        if not os.path.isdir(self._model.session['outputdir'] + '/' + sessionName):
+            return sessionName
+        else:
+            return self._sessionDir(sessionName + '_1')
+
+    def _parseSingleFile(self, path, base, name):
+        """Reads in the contents of a single fd file and returns header and values."""
+
+        # Open file
+        with open(path + base + name, 'r') as dataFile:
+            # Read lines into a list
+            lines = dataFile.read().splitlines()
+            # Get header in order
+            header = [line.split('=')[0].rstrip().lstrip() for line in lines]
+            # Get header and values in oder
+            header_and_values = {line.split('=')[0].rstrip().lstrip():
+                                 line.split('=')[-1].lstrip().rstrip() for line in lines}
+            # Return in this order
+            return header_and_values, header
+
+    def saveFileTemplate(self):
+        """Called externally, saves the file template to the session directory."""
+
+        # Get save path
+        path = self._model.session['outputdir'] + '/' + \
+               self._model.session['sessionname'] + '/'
+
+        # Get extension of data files (assume all files come form same folder)
+        ext = self._model.session['datafiles'][0].split(".")[-1]
+        dataPath = os.path.dirname(self._model.session['datafiles'][0])
+        loadEntry = dataPath + '/' + '*.' + ext
+        saveEntry = path + 'individual_estimates' + '/*.dat'
+
+        # Fill up template and save
+        toSave = self.controlFileTemplate.format(loadEntry, saveEntry)
+        with open(path + 'session.ctl', 'w') as ctl:
+            ctl.write(toSave)
+        return path + 'session.ctl'
+
+    def abort(self):
+        """Thread-safe, aborts a running estimation."""
+
+        pool = self._pool
+        if pool is not None:
+            pool.abort()
+
+    def reset(self):
+        """Resets flags."""
+
+        self.controlFileTemplate = None
+        self.aborted = False
+        self.error = False
+        self.failures = []
+
+
+class FastDmCdfCalculation:
+
+    def __init__(self, model, log=None):
+        """Creates a new cdf calculation which will calculate cdf files, errors are passed to log(str)."""
+
+        self._model = model
+        self._log = log if log is not None else _discard
+        # Directory and file name suffix of the written files, function writing them
+        self._directory = CDFDIR
+        self._suffix = '_cdf.csv'
+        self._calculate = calculateCdfFiles
+        self._plot = 'cdf-plot'
+
+    def task(self, indices):
+        """
+        Returns the task (function, arguments) calculating the cdf files of the data sets
+        with the given indices, e.g. for a single data set as a stage of FastDmPipeline.
+        """
+
+        files = self._model.session['datafiles']
+        cdfDir = self._createCdfDir()
+        return self._calculate, ([files[idx] for idx in indices],
+                                 [self._getParameterFileName(files[idx]) for idx in indices],
+                                 [self._getConcatenatedFileName(files[idx], cdfDir) for idx in indices],
+                                 self._cdfSettings())
+
+    def isWritten(self, idx):
+        """Checks if the file of the data set with index idx has been written (e.g. by a previous run)."""
+
+        return os.path.isfile(self._getConcatenatedFileName(self._model.session['datafiles'][idx],
+                                                            self._createCdfDir()))
+
+    def bundle(self):
+        """Collects the curves of all data sets into a single binary bundle, see bundleCurves."""
+
+        cdfDir = self._createCdfDir()
+        bundleCurves([self._getConcatenatedFileName(file, cdfDir) for file in self._model.session['datafiles']],
+                     cdfDir + '/' + self._directory + BUNDLE_SUFFIX, self._plot)
+
+    def _createCdfDir(self):
+        """Creates cdf dir name and returns it as aa string."""
+
+        # Get name of cdf dir
+        cdfDir = self._model.session['outputdir'] + '/' + \
+                 self._model.session['sessionname'] + '/' + \
+                 self._directory
+
+        # Create new cdf directory (already there, if a previous run was resumed)
+        if not os.path.isdir(cdfDir):
+            os.mkdir(cdfDir)
+
+        # Return if successful
+        return cdfDir
+
+    def _cdfSettings(self):
+        """Returns everything calculateCdfFiles needs to know about the model (picklable)."""
+
+        return {'RESPONSE': self._model.session['RESPONSE']['idx'],
+                'TIME': self._model.session['TIME']['idx'],
+                'defaults': {key: entry['val'] for key, entry in self._model.parameters.items()}}
+
+    def _getParameterFileName(self, fname):
+        """Accepts a data file file name and returns the name of its parameter file."""
+
+        return self._model.session['outputdir'] + '/' + \
+               self._model.session['sessionname'] + '/' + \
+               PARAMETERSDIR + '/' + 'parameters_' + fname.split('/')[-1]
+
+    def _getConcatenatedFileName(self, fname, cdfDir):
+        """Accepts a data file file name and dir name, and returns a real cdf file name."""
+
+        return cdfDir + '/' + 'parameters_' + os.path.splitext(fname.split('/')[-1])[0] + self._suffix
+
+
+class FastDmDensityCalculation(FastDmCdfCalculation):
+
+    def __init__(self, model, log=None):
+        """
+        Creates a new density calculation which will calculate density files (see
+        calculateDensityFiles) the same way as cdf files, errors are passed to log(str).
+        """
+
+        super(FastDmDensityCalculation, self).__init__(model, log)
+        self._directory = DENSITYDIR
+        self._suffix = '_density.csv'
+        self._calculate = calculateDensityFiles
+        self._plot = 'density-plot'
+
+
+def calculateCdfFiles(dataFileNames, parameterFileNames, cdfFileNames, settings):
+    """
+    Calculates the cdf files of a chunk of data sets (see FastDmCdfCalculation.task). Settings hold
+    the column indices of RESPONSE and TIME and default parameters for those missing in a
+    parameter file. Data sets which cannot be read (e.g. not estimated) or whose parameters
+    depend on conditions are skipped and reported in the log. Returns (returncode, log),
+    module level so it can be run by worker processes.
+    """
+
+    names, rts, parameters, log = _readDataSets(dataFileNames, parameterFileNames, cdfFileNames,
+                                                settings, 'cdf values')
+    if names:
+        predX, predY = _calculatePredictedCdf(rts, parameters)
+        _calculateEmpiricalCdf(names, rts, predX, predY)
+    return 0, '\n'.join(log)
+
+
+def calculateDensityFiles(dataFileNames, parameterFileNames, densityFileNames, settings):
+    """
+    Calculates the density files of a chunk of data sets, see calculateCdfFiles. Each file
+    holds the predicted density of signed response times (negative at the lower threshold)
+    next to the empirical density of the data set in DENSITY_BINS bins.
+    """
+
+    names, rts, parameters, log = _readDataSets(dataFileNames, parameterFileNames, densityFileNames,
+                                                settings, 'density')
+    if not names:
+        return 0, '\n'.join(log)
+
+    predX, predY = _calculatePredictedDensity(rts, parameters)
+    for idx, name in enumerate(names):
+
+        # Binned density over both responses, so it has the same area as the predicted one
+        empY, edges = np.histogram(rts[idx], bins=DENSITY_BINS, range=(predX[idx, 0], predX[idx, -1]), density=True)
+        empX = 0.5 * (edges[:-1] + edges[1:])
+        _concatenateFiles(name, empX, empY, predX[idx], predY[idx], 'density-plot')
+    return 0, '\n'.join(log)
+
+
+def _readDataSets(dataFileNames, parameterFileNames, fileNames, settings, what):
+    """
+    Reads signed response times and estimated parameters of a chunk of data sets, returns
+    them as lists with the names of the files to write and a log of unreadable data sets.
+    """
+
+    names, rts, parameters, log = [], [], [], []
+    for dataFileName, parameterFileName, fileName in zip(dataFileNames, parameterFileNames, fileNames):
+
+        # Data sets fast-dm failed to estimate have no parameter file
+        try:
+            # Load file
+            data = np.genfromtxt(dataFileName, skip_header=True, ndmin=2)
+
+            # Get relevant data columns
+            response = data[:, settings['RESPONSE']]
+            rt = data[:, settings['TIME']]
+
+            # Reverse time data (mirror negative)
+            rt = np.where(response == 0, -rt, rt)
+            params = _readParameters(parameterFileName, settings['defaults'])
+
+        except (OSError, ValueError, IndexError) as e:
+            log.append('Could not calculate {} for {}: {}'.format(what, dataFileName, e))
+            continue
+
+        names.append(fileName)
+        rts.append(rt)
+        parameters.append(params)
+    return names, rts, parameters, log
+
+
+def _calculatePredictedCdf(rts, parameters):
+    """Calculates predicted cdfs of all data sets at once, each on a grid covering its data."""
+
+    # One row of parameters per data set
+    columns = {key: np.array([params[key] for params in parameters])
+               for key in ('a', 'zr', 'v', 't0', 'd', 'szr', 'sv', 'st0', 'p')}
+
+    # Symmetric grid of signed response times covering the data of each data set
+    limits = np.array([np.abs(rt).max() for rt in rts]) * CDF_MARGIN
+    predX = np.linspace(-1.0, 1.0, CDF_POINTS)[np.newaxis, :] * limits[:, np.newaxis]
+
+    return predX, wienerCdf(predX, contaminants=_contaminants(rts), **columns)
+
+
+def _calculatePredictedDensity(rts, parameters):
+    """Calculates predicted densities of signed response times on the grids of _calculatePredictedCdf."""
+
+    # One column of parameters per data set, broadcast over its grid
+    columns = {key: np.array([params[key] for params in parameters])[:, np.newaxis]
+               for key in ('a', 'zr', 'v', 't0', 'd', 'szr', 'sv', 'st0', 'p')}
+    limits = np.array([np.abs(rt).max() for rt in rts]) * CDF_MARGIN
+    predX = np.linspace(-1.0, 1.0, CDF_POINTS)[np.newaxis, :] * limits[:, np.newaxis]
+
+    return predX, wienerDensity(np.abs(predX), predX > 0, contaminants=_contaminants(rts), **columns)
+
+
+def _contaminants(rts):
+    """Returns the range of contaminants of each data set (as columns), that of its response times."""
+
+    return (np.array([np.abs(rt).min() for rt in rts])[:, np.newaxis],
+            np.array([np.abs(rt).max() for rt in rts])[:, np.newaxis])
+
+
+def _readParameters(fname, defaults):
+    """
+    Reads estimated parameters, missing ones (fixed in older versions) are taken from defaults.
+    Raises ValueError for parameters estimated per condition (depends, e.g. v_easy), a single
+    curve of the data set would not fit any of them.
+    """
+
+    parameters = dict(defaults)
+    # Open file and read parameters
+    with open(fname, 'r') as infile:
+        for line in infile:
+            # Remove all whitespaces and split after = sign
+            line = ''.join(line.split()).split('=')
+            if line[0] in parameters:
+                parameters[line[0]] = float(line[-1])
+            elif line[0].split('_')[0] in parameters:
+                raise ValueError('{} depends on conditions'.format(line[0].split('_')[0]))
+    return parameters
+
+
+def _calculateEmpiricalCdf(cdfFileNames, rts, predX, predY):
+    """Calculates empirical cdfs and writes them next to the predicted cdfs."""
+
+    # Loop through all estimated datafiles
+    for idx, cdfFileName in enumerate(cdfFileNames):
+
+        # Calculate empirical cdf (returns an object)
+        empCdf = ECDF(rts[idx])
+
+        # Replace negative inf in x
+        empCdf.x[np.isneginf(empCdf.x)] = \
+            np.min(empCdf.x[np.logical_not(np.isneginf(empCdf.x))])
+
+        # Concatenate empirical and predicted
+        _concatenateFiles(cdfFileName, empCdf.x, empCdf.y, predX[idx], predY[idx], 'cdf-plot')
+
+
+def _concatenateFiles(fname, empXs, empYs, predXs, predYs, plot):
+    """Concatenates predicted and empirical cdfs (or densities), plot flags the kind for the Plot tab."""
+
+    # Pad the ragged empirical and predicted columns with NaN into a single table
+    columns = [np.asarray(column, dtype=float) for column in (empXs, empYs, predXs, predYs)]
+    table = np.full((max(len(column) for column in columns), len(columns)), np.nan)
+    for idx, column in enumerate(columns):
+        table[:len(column), idx] = column
+
+    # Format all rows in a single operation, python floats print the same as before
+    rows = ('%r\t%r\t%r\t%r\n' * table.shape[0]) % tuple(table.ravel().tolist())
+
+    # Write out header and values in one buffered write
+    with open(fname, 'w') as testfile:
+        testfile.write('# x_emp\ty_emp\tx_pred\ty_pred; {}\n'.format(plot) + rows.replace('nan', 'NaN'))
+
+    # Keep a binary copy of the table until it is bundled
+    np.save(_binaryFileName(fname), table)
+
+
+def bundleCurves(fileNames, bundleName, plot):
+    """
+    Collects the curves of cdf (or density) files from the binary copies written next to
+    them into a bundle for the Plot tab. bundleName + '.npy' holds x (first row) and y
+    (second row) of all curves one after another, bundleName + '.json' the plot flag of the
+    files (see _concatenateFiles) and the column range of the empirical and the predicted
+    curve of each file by its name. Files without a copy are taken from the previous bundle
+    (e.g. kept by a resumed run), if they are in it, or left out (e.g. not estimated), copies
+    are removed. Returns the number of bundled files.
+    """
+
+    previous = _readBundle(bundleName)
+    curves, index, offset = [], {}, 0
+    for fileName in fileNames:
+        name = fileName.split('/')[-1]
+        try:
+            table = np.load(_binaryFileName(fileName))
+        except OSError:
+            if name not in previous or not os.path.isfile(fileName):
+                continue
+            pair = previous[name]
+        else:
+            os.remove(_binaryFileName(fileName))
+            # Empirical and predicted columns are padded with NaN to the same length
+            pair = {kind: table[~np.isnan(table[:, column]), column:column + 2].T
+                    for kind, column in (('empirical', 0), ('predicted', 2))}
+
+        ranges = {}
+        for kind in ('empirical', 'predicted'):
+            ranges[kind] = [offset, offset + pair[kind].shape[1]]
+            curves.append(pair[kind])
+            offset += pair[kind].shape[1]
+        index[name] = ranges
+
+    if not index:
+        return 0
+
+    # Index is written last, the Plot tab only uses bundles newer than their files
+    np.save(bundleName + '.npy', np.ascontiguousarray(np.concatenate(curves, axis=1)))
+    with open(bundleName + '.json', 'w') as indexFile:
+        json.dump({'plot': plot, 'curves': index}, indexFile)
+    return len(index)
+
+
+def _readBundle(bundleName):
+    """Returns the curves of an existing bundle as name -> {kind: curve (x and y row)}, empty if there is none."""
+
+    try:
+        with open(bundleName + '.json', 'r') as indexFile:
+            index = json.load(indexFile)['curves']
+        values = np.load(bundleName + '.npy')
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {name: {kind: values[:, start:end] for kind, (start, end) in ranges.items()}
+            for name, ranges in index.items()}
+
+
+def _binaryFileName(fname):
+    """Returns the name of the binary copy of a cdf (or density) file, a hidden file next to it."""
+
+    directory, name = os.path.split(fname)
+    return directory + '/.' + os.path.splitext(name)[0] + '.npy'
+
+
+class FastDmSimulation:
+    """Main class to simulate data sets in-process, errors are passed to log(str)."""
+
+    def __init__(self, model, flag, log=None, progress=None):
+
+        self._model = model
+        self._flag = flag
+        self._log = log if log is not None else _discard
+        self._progress = progress if progress is not None else _discard
+        self.aborted = False
+        self._abortRequested = False
+
+    def run(self):
+        """Launches the simulation, blocks until finished or aborted."""
+
+        # Set flag
+        self._flag['run'] = True
+        self._abortRequested = False
+        # Get directory
+        simDir = self._getSimDir()
+        # Simulate and write out data sets
+        self._simulate(simDir)
+
+    def _simulate(self, simDir):
+        """
+        Simulates all data sets with the native simulator, in chunks of samples so an abort
+        takes effect soon, and writes them as sim_<n>.lst files, as construct-samples did.
+        """
+
+        options = self._model.simOptions
+        nTrials, nSamples = options['ntrials'], options['nsamples']
+
+        # Draw a seed if none is given and report it, so the simulation can be reproduced
+        seed = options['seed'] if options['seed'] is not None else int(np.random.SeedSequence().entropy % 2 ** 32)
+        self._log('Simulating with seed {}.'.format(seed))
+        seeds = np.random.SeedSequence(seed)
+
+        chunkSize = max(1, SIMULATION_CHUNK_TRIALS // nTrials)
+        for first in range(0, nSamples, chunkSize):
+
+            # Stop if user has aborted
+            if self._abortRequested or not self._flag['run']:
+                self.aborted = True
+                return
+
+            # Each chunk has its own random stream, derived from the seed
+            rt, response = simulateDiffusion(nTrials, min(chunkSize, nSamples - first),
+                                             precision=options['precision'],
+                                             seed=seeds.spawn(1)[0],
+                                             deterministic=options['determ'],
+                                             **self._model.simParameters)
+            for idx in range(rt.shape[0]):
+                np.savetxt(simDir + 'sim_{}.lst'.format(first + idx), np.column_stack((response[idx], rt[idx])),
+                           fmt=['%d', '%.6f'])
+            self._progress(first + rt.shape[0])
+
+    def abort(self):
+        """Thread-safe, aborts a running simulation."""
+
+        self._abortRequested = True
+
+    def _getSimDir(self):
+        """Returns the full path to the simulation directory. Assumes settings sanity."""
+
+        # Get name of sim dir
+        simDir = self._model.simOptions['outputdir'] + '/' + \
+                 self._sessionDir(self._model.simOptions['sessionname']) + '/'
+
+        # Create new simulation directory
+        os.mkdir(simDir)
+
+        # Return path to sim dir
+        return simDir
+
+    def _sessionDir(self, sessionName):
+        """Recursively check if session dir exists and append 1 if so."""
+
+        if not os.path.isdir(self._model.simOptions['outputdir'] + '/' + sessionName):
+            return sessionName
+        else:
+            return self._sessionDir(sessionName + '_1')
+
+
+def modelProblem(model):
+    """
+    Checks various conditions for the model output,
+    returns a description of the first problem found, None if anything ok.
+    """
+
+    # ===== Check if any data left ===== #
+    if not model.session['datafiles']:
+        return 'No data files loaded!'
+
+    # ===== Check if RESPONSE AND TIME specified ===== #
+    if not model.session['TIME']['name']:
+        return 'No "Reaction Times Column" specified!'
+
+    if not model.session['RESPONSE']['name']:
+        return 'No "Responses Column" specified!'
+
+    # ===== Check if output directory specified ===== #
+    if not model.session['outputdir']:
+        return 'No output location specified!'
+
+    # ===== Check if session name specified ===== #
+    if not model.session['sessionname']:
+        return 'No directory name specified!'
+
+    # ===== Check if output directory exists ===== #
+    if not os.path.exists(model.session['outputdir']):
+        return 'Output location is nonexistent!'
+
+    # ===== Check if path to fast dm correctly specified (workers use their own) ===== #
+    if not model.computation['coordinator'] and model.computation['backend'] != 'native' and \
+            not os.path.isfile(model.session['fastdmpath']):
+        return 'Could not find fast-dm executable. Check your path settings!'
+
+    # ===== If we are here, all tests have been passed ===== #
+    return None
+
+
+def simulationProblem(model):
+    """
+    Checks various conditions for simulation (actually path issues),
+    returns a description of the first problem found, None if anything ok.
+    """
+
+    # ===== Check if output directory specified ===== #
+    if not model.simOptions['outputdir']:
+        return 'No output location specified!'
+
+    # ===== Check if session name specified ===== #
+    if not model.simOptions['sessionname']:
+        return 'No directory name specified!'
+
+    # ===== Check if output directory exists ===== #
+    if not os.path.exists(model.simOptions['outputdir']):
+        return 'Output location is nonexistent!'
+
+    # ===== If we are here, all tests have been passed ===== #
+    return None
+
+
+def _discard(*args):
+    """Default callback, ignores everything passed to it."""
+
+    pass
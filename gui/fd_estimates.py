@@ -0,0 +1,107 @@
+import numpy as np
+import os
+
+
+"""Number of rows after which the binary columnar file is rewritten."""
+BINARY_FLUSH_ROWS = 500
+
+
+class FastDmEstimateTable:
+
+    def __init__(self, csvFileName, binaryFileName=None):
+        """
+        Creates a table of estimates of all data sets, whose columns are the union
+        of the headers of all parameter files (in order of first appearance). Each
+        row is appended to the csv file as soon as it is added, and, if a binary
+        file name is given, all rows are also stored as a columnar numpy archive.
+        """
+
+        self._csvFileName = csvFileName
+        self._binaryFileName = binaryFileName
+        self.columns = []
+        self.datasets = []
+        self._rows = []
+        self._unflushed = 0
+        self._csvFile = open(self._csvFileName, 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, dataset, values, header):
+        """Adds the estimates (dict header -> value) of a single data set."""
+
+        # Extend columns by keys not seen so far
+        newColumns = [column for column in header if column not in self.columns]
+        self.columns.extend(newColumns)
+        self.datasets.append(dataset)
+        self._rows.append(values)
+
+        # Rows written so far lack the new columns, so rewrite whole file
+        if newColumns and len(self._rows) > 1:
+            self._rewriteCsv()
+        else:
+            if len(self._rows) == 1:
+                self._writeLine(['dataset'] + self.columns)
+            self._writeLine([dataset] + [values.get(column, '') for column in self.columns])
+        self._csvFile.flush()
+
+        # Rewrite binary file from time to time, so a crash loses little
+        self._unflushed += 1
+        if self._binaryFileName is not None and self._unflushed >= BINARY_FLUSH_ROWS:
+            self._writeBinary()
+
+    def close(self):
+        """Closes the csv file and writes the final binary file."""
+
+        self._csvFile.close()
+        if self._binaryFileName is not None and self._rows:
+            self._writeBinary()
+
+    def _rewriteCsv(self):
+        """Writes header and all rows from scratch."""
+
+        self._csvFile.seek(0)
+        self._csvFile.truncate()
+        self._writeLine(['dataset'] + self.columns)
+        for dataset, values in zip(self.datasets, self._rows):
+            self._writeLine([dataset] + [values.get(column, '') for column in self.columns])
+
+    def _writeLine(self, entries):
+        """Writes a single line of the csv file."""
+
+        self._csvFile.write(';'.join(entries) + '\n')
+
+    def _writeBinary(self):
+        """Writes all rows as one float array per column (NaN if missing) plus data set names."""
+
+        arrays = {column: np.array([_toFloat(values.get(column)) for values in self._rows])
+                  for column in self.columns}
+        arrays['dataset'] = np.array(self.datasets)
+        arrays['columns'] = np.array(self.columns)
+
+        # Write to temporary file first, so readers never see a partial file
+        tempFileName = self._binaryFileName + '.tmp'
+        with open(tempFileName, 'wb') as binaryFile:
+            np.savez(binaryFile, **arrays)
+        os.replace(tempFileName, self._binaryFileName)
+        self._unflushed = 0
+
+
+def loadEstimateTable(binaryFileName):
+    """Returns data set names and a dict column -> float array from a binary estimates file."""
+
+    with np.load(binaryFileName) as archive:
+        columns = {str(column): archive[str(column)] for column in archive['columns']}
+        return [str(name) for name in archive['dataset']], columns
+
+
+def _toFloat(value):
+    """Converts an estimate to float, NaN if missing or not a number."""
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,760 @@
+from collections import OrderedDict
+from fd_cache import FastDmEvaluationCache
+from fd_cdf_table import openCdfTable
+from fd_wiener import wienerDensity, wienerCdf
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+
+"""Initial step of each parameter in the Nelder-Mead simplex."""
+SIMPLEX_STEPS = {'a': 0.3, 'zr': 0.1, 'v': 0.5, 't0': 0.05, 'd': 0.05,
+                 'szr': 0.1, 'sv': 0.3, 'st0': 0.05, 'p': 0.02}
+
+"""Quantiles of the response times bounding the bins of the chi-square method."""
+CS_QUANTILES = (0.1, 0.3, 0.5, 0.7, 0.9)
+
+"""Minimum number of responses at a threshold needed to split them into quantile bins."""
+CS_MIN_TRIALS = 10
+
+"""Maximum number of objective evaluations per free parameter and simplex run."""
+EVALUATIONS_PER_PARAMETER = 400
+
+"""Number of times the simplex is restarted at the optimum found so far."""
+RESTARTS = 2
+
+"""Further starts of a multi-start fit are spread around the start values by up to this many simplex steps."""
+MULTISTART_SPREAD = 3.0
+
+"""
+A start is cancelled once its best value is behind the best start of its data set by more than
+MULTISTART_MARGIN (in units of the objective), but not before MULTISTART_GRACE evaluations per
+free parameter, which all starts need to get anywhere near an optimum.
+"""
+MULTISTART_MARGIN = 5.0
+MULTISTART_GRACE = 30
+
+"""Seed of the spread of starts, so a multi-start fit is reproducible."""
+MULTISTART_SEED = 0
+
+
+class FastDmEstimator:
+
+    def __init__(self, parameters, method, precision, cdfTable=None, starts=1):
+        """
+        Creates a native estimator for model parameters given as in FastDmModel
+        (fixed values, free parameters and depends), the method ('ml', 'ks' or 'cs')
+        and the precision, which sets the tolerance of the optimization. If a cdf
+        lookup table (FastDmCdfTable) is given, ks and cs interpolate cdfs from it.
+        Objectives are evaluated at parameters quantized to a grid finer than the precision
+        and kept in an evaluation cache (cache), so revisited parameters are not evaluated again.
+        With several starts, each data set is optimized from as many starting points.
+        """
+
+        self._parameters = parameters
+        self._method = method
+        self._starts = starts
+        self._cdf = wienerCdf if cdfTable is None else cdfTable.cdf
+        self._tolerance = 10.0 ** -float(precision)
+        self.cache = FastDmEvaluationCache(precision)
+        # Id of the next data set, part of its cache keys
+        self._nextDataset = 0
+        self._conditionColumns = _conditionColumns(parameters)
+
+    def fit(self, rt, response, columns):
+        """
+        Estimates all free parameters from response times, responses (0 or 1) and
+        a dict of condition columns (name -> array) needed by depends. Returns an
+        ordered dict of all parameters, named as in fast-dm's parameter files
+        (e.g. v_easy for v depending on a column with the value easy), the fit and
+        the number of starts which reached the best fit (within ten times the tolerance).
+        """
+
+        return self.fitStatistics(self.statistics(rt, response, columns))
+
+    def statistics(self, rt, response, columns):
+        """
+        Returns everything the method needs of a data set (arguments as in fit), computed
+        once: its conditions (values of the condition columns), their number of trials and
+        prepared data, and the range of response times. For cs, these are a few quantile
+        bins per condition, independent of the number of trials, which can be stored (see
+        saveStatistics). The other methods need the trials as well, sorted by condition
+        (trials), and those of each condition as views into them (data).
+        """
+
+        # Integer code of each trial's value per condition column, combined into a condition index
+        values, codes = [], []
+        for column in self._conditionColumns:
+            columnValues, columnCodes = np.unique(columns[column], return_inverse=True)
+            values.append(columnValues)
+            codes.append(columnCodes.reshape(-1))
+        if codes:
+            combinations, index = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+            index = index.reshape(-1)
+        else:
+            combinations, index = np.zeros((1, 0), dtype=int), np.zeros(len(rt), dtype=int)
+        conditions = [tuple(str(values[dim][code]) for dim, code in enumerate(combination))
+                      for combination in combinations]
+
+        # Sort trials by condition once, each condition is a range of them
+        order = np.argsort(index, kind='stable')
+        rt, response = rt[order], response[order]
+        offsets = np.r_[0, np.cumsum(np.bincount(index, minlength=len(conditions)))]
+        data = [(rt[start:end], response[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+        statistics = {'conditions': conditions, 'counts': np.diff(offsets).tolist(),
+                      'prepared': [self._prepare(rtC, responseC) for rtC, responseC in data],
+                      'range': (float(rt.min()), float(rt.max()))}
+        if self._method != 'cs':
+            statistics['trials'], statistics['data'] = (rt, response), data
+        return statistics
+
+    def fitStatistics(self, statistics):
+        """Estimates all free parameters from the statistics of a data set, returns them as fit does."""
+
+        # All conditions are segments of a single objective, as data sets of a batch are
+        design = self._design(statistics)
+        best, values, agreed = self._fitGroup([design])
+        return self._estimates(design, best[0]), self._fitValue(values[0]), agreed[0]
+
+    def _design(self, statistics):
+        """
+        Determines the free parameters of a data set from its statistics. Returns a dict of
+        the data set's id, the names, parameter keys, start values and simplex steps, the fixed
+        parameters, the index of each condition's parameters (sources), the trials sorted by
+        condition (None for cs), the prepared data and number of trials of each condition and
+        the range of contaminants.
+        """
+
+        conditions = statistics['conditions']
+
+        # Determine free parameters (name and parameter key) and the index of each condition's ones
+        names, keys, start, steps = [], [], [], []
+        fixed = {key: float(entry['val']) for key, entry in self._parameters.items() if entry['fix']}
+        sources = []
+        for condition in conditions:
+            source = {}
+            for key, entry in self._parameters.items():
+                if entry['fix']:
+                    continue
+                level = [condition[self._conditionColumns.index(column)] for column in entry['depends']]
+                name = '_'.join([key] + [str(value) for value in level])
+                if name not in names:
+                    names.append(name)
+                    keys.append(key)
+                    start.append(self._startValue(key, entry['val'], statistics['range'][0]))
+                    steps.append(SIMPLEX_STEPS[key])
+                source[key] = names.index(name)
+            sources.append(source)
+
+        self._nextDataset += 1
+        return {'id': self._nextDataset - 1, 'names': names, 'keys': keys, 'start': np.array(start, dtype=float),
+                'steps': np.array(steps, dtype=float), 'fixed': fixed, 'sources': sources,
+                'trials': statistics.get('trials'), 'prepared': statistics['prepared'],
+                'counts': statistics['counts'], 'contaminants': statistics['range']}
+
+    def _estimates(self, design, theta):
+        """Collects fixed and estimated parameters (theta) of a data set in model order."""
+
+        estimates = OrderedDict()
+        for key in self._parameters:
+            if key in design['fixed']:
+                estimates[key] = design['fixed'][key]
+            for idx, name in enumerate(design['names']):
+                if design['keys'][idx] == key:
+                    estimates[name] = theta[idx]
+        return estimates
+
+    def _startValue(self, key, value, fastest):
+        """Returns a valid starting value of a free parameter, given the fastest response time."""
+
+        # Non-decision time has to be below the fastest response
+        if key == 't0':
+            return min(value, 0.8 * fastest)
+        # Starting point variability of zero would start on the boundary of valid values
+        if key in ('szr', 'sv', 'st0') and value <= 0:
+            return 0.5 * SIMPLEX_STEPS[key]
+        return value
+
+    def _prepare(self, rt, response):
+        """Returns the data of a condition as needed by the method."""
+
+        # Signed response times, lower threshold negative
+        signed = np.sort(np.where(response > 0.5, rt, -rt))
+        if self._method != 'cs':
+            return signed
+
+        # Quantile bins of each threshold's response times, or a single bin for few responses
+        bins = []
+        for upper in (False, True):
+            times = np.sort(rt[(response > 0.5) == upper])
+            if len(times) >= CS_MIN_TRIALS:
+                edges = np.quantile(times, CS_QUANTILES)
+                observed = np.diff(np.r_[0, np.searchsorted(times, edges, side='right'), len(times)])
+            else:
+                edges = np.array([])
+                observed = np.array([len(times)])
+            bins.append((edges, observed))
+        return bins
+
+    def _fitGroup(self, designs):
+        """
+        Minimizes the objectives of data sets with the same free parameters in lockstep, returns
+        best points, values and the number of starts which reached the best value. The conditions
+        of all data sets are segments of one objective, evaluated in a single vectorized call,
+        however many conditions and data sets there are. Each start of a multi-start fit is one
+        more problem of the same lockstep optimization, starts clearly behind the best one of
+        their data set are cancelled (see MULTISTART_MARGIN).
+        """
+
+        # One problem per data set and start, starts of a data set share its cache entries
+        problems = [design for design in designs for start in range(self._starts)]
+        owner = np.repeat(np.arange(len(designs)), self._starts)
+        segments = self._segments(problems)
+
+        def objective(points, mask):
+            """Objective of each problem (row of points) in mask, inf for invalid parameters."""
+
+            # Parameters of each segment, taken from its problem's point on the grid of the cache
+            points = self.cache.quantize(points)
+            params = {key: points[segments['owner'], column] for key, column in segments['columns'].items()}
+            params.update({key: np.full(len(segments['owner']), value) for key, value in designs[0]['fixed'].items()})
+
+            # A problem is invalid, if the parameters of any of its conditions are
+            invalid = np.bincount(segments['owner'], weights=~_isValid(params), minlength=len(problems)) > 0
+            active = mask[segments['owner']] & ~invalid[segments['owner']]
+
+            # Sum objectives of segments per problem, evaluating only segments not cached
+            values = np.full(len(problems), np.inf)
+            if active.any():
+                keys, segmentValues, missing = self._cachedObjectives(points, active, segments)
+                if missing.any():
+                    segmentValues[missing] = self._segmentObjectives(params, missing, segments)[missing]
+                    for segment in np.flatnonzero(missing):
+                        self.cache.put(keys[segment], segmentValues[segment])
+                totals = np.bincount(segments['owner'][active], weights=segmentValues[active], minlength=len(problems))
+                valid = mask & ~invalid
+                values[valid] = totals[valid]
+            return values
+
+        # Starts clearly behind the best start of their data set are not optimized any further
+        cancelled = np.zeros(len(problems), dtype=bool)
+        grace = MULTISTART_GRACE * len(designs[0]['names'])
+
+        def cancel(current, evaluations):
+            """Returns (and remembers) problems to cancel, given their current best values and evaluations."""
+
+            current = np.minimum(current, values)
+            leading = np.full(len(designs), np.inf)
+            np.minimum.at(leading, owner, current)
+            behind = (evaluations >= grace) & (current > leading[owner] + MULTISTART_MARGIN)
+            cancelled[behind] = True
+            return behind
+
+        # Minimize, restart the simplex of each problem at its optimum until it does not improve
+        best = np.array([point for design in designs for point in self._startPoints(design)])
+        values = objective(best, np.ones(len(problems), dtype=bool))
+        restart = np.ones(len(problems), dtype=bool)
+        for run in range(RESTARTS + 1):
+            candidates, candidateValues = batchNelderMead(objective, best, designs[0]['steps'], self._tolerance,
+                                                          EVALUATIONS_PER_PARAMETER * len(designs[0]['names']),
+                                                          restart, cancel if self._starts > 1 else None)
+            improved = restart & (values - candidateValues > self._tolerance)
+            better = restart & (candidateValues <= values)
+            best[better], values[better] = candidates[better], candidateValues[better]
+            restart = improved & ~cancelled
+            if not restart.any():
+                break
+
+        # Best start of each data set, and how many starts reached its value
+        values = values.reshape(len(designs), self._starts)
+        chosen = np.arange(len(designs)) * self._starts + np.argmin(values, axis=1)
+        leading = values.min(axis=1)
+        agreed = (values <= leading[:, np.newaxis] + 10.0 * self._tolerance).sum(axis=1)
+        return best[chosen], leading, agreed
+
+    def _startPoints(self, design):
+        """
+        Returns the starting points of a data set: its start values, and, for a multi-start fit,
+        valid points spread around them (reproducibly). Non-decision time stays below the
+        fastest response, as for the start values.
+        """
+
+        points = [design['start']]
+        rng = np.random.default_rng(MULTISTART_SEED)
+        ceiling = np.where(np.array(design['keys']) == 't0', 0.8 * design['contaminants'][0], np.inf)
+        for attempt in range(100 * self._starts):
+            if len(points) == self._starts:
+                break
+            spread = rng.uniform(-MULTISTART_SPREAD, MULTISTART_SPREAD, len(design['start']))
+            point = np.minimum(design['start'] + design['steps'] * spread, ceiling)
+            if all(_isValid(dict(design['fixed'], **{key: point[position] for key, position in source.items()}))
+                   for source in design['sources']):
+                points.append(point)
+
+        # Start values again, if hardly any points are valid
+        return points + [design['start']] * (self._starts - len(points))
+
+    def _cachedObjectives(self, points, active, segments):
+        """
+        Looks up the objectives of active segments at points in the cache. Returns the cache key
+        of each segment (None if not active), their values and a mask of active segments missing.
+        """
+
+        keys = [None] * len(active)
+        values = np.zeros(len(active))
+        missing = np.zeros(len(active), dtype=bool)
+        columns = list(segments['columns'].values())
+        for segment in np.flatnonzero(active):
+            point = points[segments['owner'][segment]]
+            keys[segment] = self.cache.key(segments['ids'][segment], [point[column[segment]] for column in columns])
+            value = self.cache.get(keys[segment])
+            if value is None:
+                missing[segment] = True
+            else:
+                values[segment] = value
+        return keys, values, missing
+
+    def _segments(self, designs):
+        """
+        Stacks the conditions of all data sets into segments. Returns a dict with the owning
+        data set and the cache id (data set id and condition) of each segment, the column of
+        each free parameter in the points per segment, the contaminant ranges, the number of
+        trials and prepared data, and, for ml, all trials with their segment and offsets, for
+        the cdf based methods, points padded to equal length.
+        """
+
+        owner, ids, sources, prepared, counts, low, high = [], [], [], [], [], [], []
+        for participant, design in enumerate(designs):
+            for idx, source in enumerate(design['sources']):
+                owner.append(participant)
+                ids.append((design['id'], idx))
+                sources.append(source)
+                prepared.append(design['prepared'][idx])
+                counts.append(design['counts'][idx])
+                low.append(design['contaminants'][0])
+                high.append(design['contaminants'][1])
+
+        segments = {'owner': np.array(owner), 'ids': ids, 'low': np.array(low), 'high': np.array(high),
+                    'columns': {key: np.array([source[key] for source in sources]) for key in sources[0]},
+                    'counts': np.array(counts), 'prepared': prepared}
+
+        # Trials of all segments in one ragged array (ml only), segment i owns offsets[i]:offsets[i + 1],
+        # trials of each data set are sorted by condition already, so a single one is used as it is
+        if self._method == 'ml':
+            segments['offsets'] = np.r_[0, np.cumsum(counts)]
+            segments['segment'] = np.repeat(np.arange(len(counts)), counts)
+            if len(designs) == 1:
+                segments['rt'], segments['response'] = designs[0]['trials']
+            else:
+                segments['rt'] = np.concatenate([design['trials'][0] for design in designs])
+                segments['response'] = np.concatenate([design['trials'][1] for design in designs])
+
+        # Points at which cdf based methods need the cdf, padded by repeating a point of the same row
+        if self._method != 'ml':
+            rows = prepared if self._method == 'ks' else [_binPoints(bins) for bins in prepared]
+            width = max(len(row) for row in rows)
+            segments['points'] = np.array([np.r_[row, np.full(width - len(row), row[-1])] for row in rows])
+            segments['lengths'] = np.array([len(row) for row in rows])
+        return segments
+
+    def _segmentObjectives(self, params, active, segments):
+        """Returns the objective of each active segment (others are undefined) in one vectorized call."""
+
+        values = np.zeros(len(active))
+
+        if self._method == 'ml':
+            # Negative log-likelihood, summed over the trials of each segment
+            trials = active[segments['segment']]
+            segment = segments['segment'][trials]
+            density = wienerDensity(segments['rt'][trials], segments['response'][trials],
+                                    contaminants=(segments['low'][segment], segments['high'][segment]),
+                                    **{key: value[segment] for key, value in params.items()})
+            with np.errstate(divide='ignore'):
+                logDensity = np.where(density > 0, np.log(np.maximum(density, 1e-300)), -np.inf)
+            values -= np.bincount(segment, weights=logDensity, minlength=len(active))
+            return values
+
+        # Cdfs of all active segments at their (padded) points
+        rows = np.flatnonzero(active)
+        cdf = self._cdf(segments['points'][rows], contaminants=(segments['low'][rows], segments['high'][rows]),
+                        **{key: value[rows] for key, value in params.items()})
+
+        if self._method == 'ks':
+            # Negative log p-value of the Kolmogorov-Smirnov statistic, ignoring padded points
+            n = segments['lengths'][rows][:, np.newaxis]
+            position = np.arange(cdf.shape[1])
+            inside = position < n
+            above = np.where(inside, (position + 1) / n - cdf, -np.inf).max(axis=1)
+            below = np.where(inside, cdf - position / n, -np.inf).max(axis=1)
+            values[rows] = -_logKolmogorov(np.maximum(above, below), n[:, 0])
+        else:
+            # Chi-square statistic over quantile bins, bins differ in number per segment
+            for row, segment in enumerate(rows):
+                values[segment] = _chiSquare(cdf[row, :segments['lengths'][segment]],
+                                             segments['prepared'][segment], segments['counts'][segment])
+        return values
+
+    def _fitValue(self, value):
+        """Converts the minimized objective to fast-dm's fit (log-likelihood, p-value or chi-square)."""
+
+        if self._method == 'ml':
+            return -value
+        elif self._method == 'ks':
+            return np.exp(-value)
+        return value
+
+
+class FastDmBatchEstimator(FastDmEstimator):
+
+    def fitAll(self, datasets):
+        """
+        Estimates many data sets, each given as (rt, response, columns) as in fit, and returns
+        a list of (estimates, fit, agreed starts). Data sets sharing the same free parameters are optimized
+        in lockstep: their trials are stacked into one ragged array (one segment per data set
+        and condition), and each simplex step evaluates the objective of all of them in a
+        single vectorized call.
+        """
+
+        return self.fitAllStatistics([self.statistics(rt, response, columns) for rt, response, columns in datasets])
+
+    def fitAllStatistics(self, statistics):
+        """Estimates many data sets from their statistics (see statistics), returns results as fitAll does."""
+
+        designs = [self._design(entry) for entry in statistics]
+
+        # Only data sets with the same free parameters (e.g. depends levels) share a simplex
+        groups = OrderedDict()
+        for idx, design in enumerate(designs):
+            groups.setdefault(tuple(design['names']), []).append(idx)
+
+        results = [None] * len(designs)
+        for members in groups.values():
+            best, values, agreed = self._fitGroup([designs[idx] for idx in members])
+            for position, idx in enumerate(members):
+                results[idx] = (self._estimates(designs[idx], best[position]), self._fitValue(values[position]),
+                                agreed[position])
+        return results
+
+
+def nelderMead(function, start, steps, tolerance, maxEvaluations):
+    """
+    Minimizes function from start by the Nelder-Mead simplex method, with initial steps
+    per dimension. Stops when all vertices and their values are within tolerance of the
+    best one, or after maxEvaluations. Returns the best point and its value.
+    """
+
+    best, values = batchNelderMead(lambda points, mask: np.array([function(points[0])]),
+                                   np.asarray(start, dtype=float)[np.newaxis], steps, tolerance, maxEvaluations)
+    return best[0], values[0]
+
+
+def batchNelderMead(function, starts, steps, tolerance, maxEvaluations, active=None, cancel=None):
+    """
+    Minimizes many problems in lockstep by the Nelder-Mead simplex method, one per row of starts.
+    function(points, mask) returns the value of each row of points, where only rows in mask need
+    to be evaluated, so all problems can be evaluated in one vectorized call. Each problem stops
+    as nelderMead does, problems not in active (default: all) are not minimized at all. After
+    each step, cancel(values, evaluations), if given, returns a mask of problems to stop early,
+    given the best value and number of evaluations of each problem.
+    Returns the best point and its value of each problem.
+    """
+
+    nProblems, n = starts.shape
+    steps = np.broadcast_to(steps, (n,))
+    active = np.ones(nProblems, dtype=bool) if active is None else active.copy()
+
+    # Initial simplex of each problem, shape (problems, vertices, dimensions)
+    simplex = np.repeat(starts[:, np.newaxis, :], n + 1, axis=1).astype(float)
+    simplex[:, 1:, :] += np.eye(n) * steps
+    values = np.full((nProblems, n + 1), np.inf)
+    for vertex in range(n + 1):
+        values[active, vertex] = function(simplex[:, vertex], active)[active]
+    evaluations = np.where(active, n + 1, 0)
+
+    while True:
+
+        # Sort vertices of each problem, best first
+        order = np.argsort(values, axis=1)
+        simplex = np.take_along_axis(simplex, order[:, :, np.newaxis], axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+
+        # Stop problems which have converged or used up their evaluations (inactive ones may hold inf)
+        with np.errstate(invalid='ignore'):
+            converged = (np.abs(simplex[:, 1:] - simplex[:, :1]).max(axis=(1, 2)) <= tolerance) & \
+                        (values[:, -1] - values[:, 0] <= tolerance)
+        active &= ~converged & (evaluations < maxEvaluations)
+        if cancel is not None:
+            active &= ~cancel(values[:, 0], evaluations)
+        if not active.any():
+            break
+
+        # Reflect worst vertex at the centroid of the others
+        centroid = simplex[:, :-1].mean(axis=1)
+        worst = simplex[:, -1]
+        reflected = centroid + (centroid - worst)
+        reflectedValues = function(reflected, active)
+        evaluations[active] += 1
+
+        # Decide per problem: expand, accept reflection or contract
+        expand = active & (reflectedValues < values[:, 0])
+        accept = active & ~expand & (reflectedValues < values[:, -2])
+        contract = active & ~expand & ~accept
+        outside = (reflectedValues < values[:, -1])[:, np.newaxis]
+
+        # Expanded or contracted (outside or inside the simplex) vertex, one call for both
+        second = np.where(expand[:, np.newaxis], centroid + 2.0 * (centroid - worst),
+                          np.where(outside, centroid + 0.5 * (reflected - centroid),
+                                   centroid + 0.5 * (worst - centroid)))
+        secondMask = expand | contract
+        secondValues = function(second, secondMask) if secondMask.any() else np.full(nProblems, np.inf)
+        evaluations[secondMask] += 1
+
+        # Expansion keeps the better of expanded and reflected vertex
+        expanded = expand & (secondValues < reflectedValues)
+        reflect = accept | (expand & ~expanded)
+        simplex[reflect, -1], values[reflect, -1] = reflected[reflect], reflectedValues[reflect]
+        simplex[expanded, -1], values[expanded, -1] = second[expanded], secondValues[expanded]
+
+        # Contraction is accepted if it improves, otherwise shrink all vertices towards the best one
+        contracted = contract & (secondValues < np.minimum(reflectedValues, values[:, -1]))
+        simplex[contracted, -1], values[contracted, -1] = second[contracted], secondValues[contracted]
+        shrink = contract & ~contracted
+        if shrink.any():
+            simplex[shrink, 1:] = simplex[shrink, :1] + 0.5 * (simplex[shrink, 1:] - simplex[shrink, :1])
+            for vertex in range(1, n + 1):
+                values[shrink, vertex] = function(simplex[:, vertex], shrink)[shrink]
+            evaluations[shrink] += n
+
+    best = np.argmin(values, axis=1)
+    rows = np.arange(nProblems)
+    return simplex[rows, best], values[rows, best]
+
+
+def readDataFile(fileName, responseIdx, timeIdx, conditionIdx):
+    """Reads response times, responses and condition columns (name -> index) of a data file."""
+
+    # Read as text, condition columns need not be numeric
+    with open(fileName, 'r') as dataFile:
+        table = np.array([line.split() for line in dataFile if line.strip() and not line.startswith('#')], dtype=str)
+    rt = table[:, timeIdx].astype(float)
+    response = table[:, responseIdx].astype(float)
+    if not np.all((response == 0) | (response == 1)):
+        raise ValueError('invalid response, responses have to be 0 or 1')
+    return rt, response, {name: table[:, idx] for name, idx in conditionIdx.items()}
+
+
+def estimateFile(dataFileName, saveFileName, settings, statisticsFileName=None):
+    """
+    Estimates a single data file and writes a parameter file as fast-dm does. Settings
+    hold parameters, method, precision, column names and indices of RESPONSE and TIME,
+    the file name of a cdf lookup table (None to calculate cdfs exactly) and the number
+    of starts per data set (the parameter file also reports how many agreed). For cs,
+    the statistics of the data file are taken from statisticsFileName, if given and
+    written before, otherwise they are written there. Returns (returncode, log),
+    module level so it can be run by worker processes.
+    """
+
+    started = time.time()
+    estimator = FastDmEstimator(settings['parameters'], settings['method'], settings['precision'],
+                                _settingsCdfTable(settings), settings['starts'])
+    statistics = _dataFileStatistics(estimator, dataFileName, settings, statisticsFileName)
+    estimates, fit, agreed = estimator.fitStatistics(statistics)
+    _writeParameterFile(saveFileName, estimates, fit, agreed, settings, time.time() - started)
+
+    return 0, 'Estimated {} trials, fit = {:.6f}{}\n{}'.format(sum(statistics['counts']), fit,
+                                                              _agreement(agreed, settings), estimator.cache.summary())
+
+
+def estimateFiles(dataFileNames, saveFileNames, settings, statisticsFileNames=None):
+    """
+    Estimates several data files in lockstep (see FastDmBatchEstimator) and writes a parameter
+    file for each. Settings and statisticsFileNames (one per data file) are as in estimateFile.
+    Each log line starts with the name of its data file, data files which cannot be read are
+    reported as errors, the others are estimated anyway. Returns (returncode, log), the
+    returncode is 0 only if all files were estimated.
+    """
+
+    started = time.time()
+    estimator = FastDmBatchEstimator(settings['parameters'], settings['method'], settings['precision'],
+                                     _settingsCdfTable(settings), settings['starts'])
+
+    # Read statistics of all data files, skip invalid ones
+    log, statistics, targets = [], [], []
+    statisticsFileNames = statisticsFileNames or [None] * len(dataFileNames)
+    for dataFileName, saveFileName, statisticsFileName in zip(dataFileNames, saveFileNames, statisticsFileNames):
+        name = dataFileName.split('/')[-1]
+        try:
+            statistics.append(_dataFileStatistics(estimator, dataFileName, settings, statisticsFileName))
+            targets.append((name, saveFileName))
+        except (OSError, ValueError, IndexError) as e:
+            log.append('{}: error: {}'.format(name, e))
+
+    # Fit time is shared by all data sets of the batch, in proportion to their trials
+    results = estimator.fitAllStatistics(statistics)
+    elapsed = time.time() - started
+    trials = [sum(entry['counts']) for entry in statistics]
+    for (name, saveFileName), nTrials, (estimates, fit, agreed) in zip(targets, trials, results):
+        _writeParameterFile(saveFileName, estimates, fit, agreed, settings, elapsed * nTrials / max(sum(trials), 1))
+        log.append('{}: Estimated {} trials, fit = {:.6f}{}'.format(name, nTrials, fit, _agreement(agreed, settings)))
+    log.append(estimator.cache.summary())
+
+    return (1 if len(targets) < len(dataFileNames) else 0), '\n'.join(log)
+
+
+def statisticsKey(dataHash, settings):
+    """
+    Returns the name under which the statistics of a data file, given by the hash of its
+    contents, are stored. It changes with everything statistics depend on: the columns
+    read, the conditions parameters are estimated for and the quantile bins.
+    """
+
+    conditionIdx = [(column, settings['columns'].index(column)) for column in _conditionColumns(settings['parameters'])]
+    text = repr([dataHash, settings['method'], settings['RESPONSE'], settings['TIME'], conditionIdx,
+                 CS_QUANTILES, CS_MIN_TRIALS])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def saveStatistics(fileName, statistics):
+    """
+    Writes cs statistics (see FastDmEstimator.statistics) as a small json file, via a
+    temporary file, so other processes never read a partial one.
+    """
+
+    content = {'conditions': [list(condition) for condition in statistics['conditions']],
+               'counts': [int(count) for count in statistics['counts']],
+               'range': list(statistics['range']),
+               'bins': [[[edges.tolist(), observed.tolist()] for edges, observed in bins]
+                        for bins in statistics['prepared']]}
+    tempFileName = '{}.{}.tmp'.format(fileName, os.getpid())
+    with open(tempFileName, 'w') as statisticsFile:
+        json.dump(content, statisticsFile)
+    os.replace(tempFileName, fileName)
+
+
+def loadStatistics(fileName):
+    """Reads cs statistics written by saveStatistics."""
+
+    with open(fileName, 'r') as statisticsFile:
+        content = json.load(statisticsFile)
+    return {'conditions': [tuple(condition) for condition in content['conditions']],
+            'counts': content['counts'],
+            'range': tuple(content['range']),
+            'prepared': [[(np.array(edges, dtype=float), np.array(observed, dtype=int)) for edges, observed in bins]
+                         for bins in content['bins']]}
+
+
+def _dataFileStatistics(estimator, dataFileName, settings, statisticsFileName):
+    """
+    Returns the statistics of a data file. For cs, they are read from statisticsFileName
+    (if given) instead of the data file, or written there once the data file is read.
+    """
+
+    stored = statisticsFileName is not None and settings['method'] == 'cs'
+    if stored and os.path.isfile(statisticsFileName):
+        try:
+            return loadStatistics(statisticsFileName)
+        except (OSError, ValueError, KeyError, TypeError):
+            # Unreadable, calculate again and replace
+            pass
+
+    statistics = estimator.statistics(*_readSettingsDataFile(dataFileName, settings))
+    if stored:
+        saveStatistics(statisticsFileName, statistics)
+    return statistics
+
+
+def _conditionColumns(parameters):
+    """Returns the condition columns any free parameter depends on, in order of first appearance."""
+
+    columns = []
+    for entry in parameters.values():
+        for column in entry['depends']:
+            if not entry['fix'] and column not in columns:
+                columns.append(column)
+    return columns
+
+
+def _settingsCdfTable(settings):
+    """Returns the cdf lookup table given by settings (opened once per process), None if there is none."""
+
+    return openCdfTable(settings['cdftable']) if settings['cdftable'] else None
+
+
+def _readSettingsDataFile(dataFileName, settings):
+    """Reads a data file including all columns parameters depend on, as described by settings."""
+
+    conditionIdx = {column: settings['columns'].index(column)
+                    for entry in settings['parameters'].values() for column in entry['depends']}
+    return readDataFile(dataFileName, settings['RESPONSE'], settings['TIME'], conditionIdx)
+
+
+def _agreement(agreed, settings):
+    """Returns how many starts of a multi-start fit agreed as part of a log line, nothing for a single start."""
+
+    return ', {} of {} starts agreed'.format(agreed, settings['starts']) if settings['starts'] > 1 else ''
+
+
+def _writeParameterFile(saveFileName, estimates, fit, agreed, settings, elapsed):
+    """Writes estimates in fast-dm's parameter file format, plus the agreed starts of a multi-start fit."""
+
+    with open(saveFileName, 'w') as saveFile:
+        for name, value in estimates.items():
+            saveFile.write('{} = {:.6f}\n'.format(name, value))
+        saveFile.write('precision = {:.6f}\n'.format(float(settings['precision'])))
+        saveFile.write('method = {}\n'.format(settings['method']))
+        saveFile.write('fit = {:.6f}\n'.format(fit))
+        saveFile.write('time = {:.2f}\n'.format(elapsed))
+        if settings['starts'] > 1:
+            saveFile.write('starts = {}\n'.format(settings['starts']))
+            saveFile.write('agreed = {}\n'.format(agreed))
+
+
+def _isValid(params):
+    """
+    Checks if a set of parameters lies within the range allowed by the diffusion model.
+    Parameters may be arrays, then each set is checked separately.
+    """
+
+    return (params['a'] > 0) & \
+        (params['szr'] >= 0) & (params['sv'] >= 0) & (params['st0'] >= 0) & \
+        (0 < params['zr'] - 0.5 * params['szr']) & (params['zr'] + 0.5 * params['szr'] < 1) & \
+        (params['t0'] - 0.5 * np.abs(params['d']) - 0.5 * params['st0'] >= 0) & \
+        (0 <= params['p']) & (params['p'] < 1)
+
+
+def _binPoints(prepared):
+    """Returns the signed response times at which the chi-square method needs the cdf."""
+
+    (lowerEdges, lowerObserved), (upperEdges, upperObserved) = prepared
+    return np.r_[0.0, -lowerEdges, upperEdges]
+
+
+def _chiSquare(cdf, prepared, n):
+    """Returns the chi-square statistic of n trials in quantile bins, given the cdf at their points."""
+
+    (lowerEdges, lowerObserved), (upperEdges, upperObserved) = prepared
+    lowerProbability = cdf[0]
+    lowerCumulative = np.r_[0.0, lowerProbability - cdf[1:1 + len(lowerEdges)], lowerProbability]
+    upperCumulative = np.r_[0.0, cdf[1 + len(lowerEdges):] - lowerProbability, 1.0 - lowerProbability]
+    expected = n * np.maximum(np.r_[np.diff(lowerCumulative), np.diff(upperCumulative)], 1e-10)
+    observed = np.r_[lowerObserved, upperObserved]
+    return np.sum((observed - expected) ** 2 / expected)
+
+
+def _logKolmogorov(statistic, n):
+    """
+    Returns the log of the asymptotic p-value of the Kolmogorov-Smirnov statistic of n samples.
+    Statistic and n may be arrays of the same shape.
+    """
+
+    rootN = np.sqrt(n)
+    lam = np.asarray((rootN + 0.12 + 0.11 / rootN) * statistic, dtype=float)
+    # Series is one for small and dominated by its first term for large arguments
+    k = np.arange(1, 101).reshape((-1,) + (1,) * lam.ndim)
+    series = 2.0 * np.sum((-1.0) ** (k - 1) * np.exp(-2.0 * k * k * lam * lam), axis=0)
+    logP = np.where(lam < 0.2, 0.0,
+                    np.where(lam > 3.0, np.log(2.0) - 2.0 * lam * lam, np.log(np.maximum(series, 1e-300))))
+    return logP[()]
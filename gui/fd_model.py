@@ -24,7 +24,18 @@ class FastDmModel:
         # ===== Group computation attributes ===== #
         self.computation = {'method': 'ks',
                             'precision': 3.0,
-                            'jobs': 1}
+                            'jobs': 1,
+                            'resume': False,
+                            'cache': True,
+                            'cachesize': 50,
+                            'coordinator': '',
+                            'longestfirst': True,
+                            'timeout': 0,
+                            'retries': 1,
+                            'backend': 'fastdm',
+                            'batchsize': 1,
+                            'cdftable': False,
+                            'starts': 1}
 
         # ===== Group session attributes ===== #
         self.session = {'datafiles': [],
@@ -44,7 +55,9 @@ class FastDmModel:
                             '{0}fast-dm-bin{0}plot-density.exe'.format(os.sep),
                         'constructpath':
                             os.path.dirname(os.path.realpath(__file__)) +
-                            '{0}fast-dm-bin{0}construct-samples.exe'.format(os.sep)
+                            '{0}fast-dm-bin{0}construct-samples.exe'.format(os.sep),
+                        'cachedir':
+                            os.path.expanduser('~') + '{0}.fast-dm{0}cache'.format(os.sep)
                         }
 
         # ===== Group plot attributes ===== #
@@ -53,7 +66,8 @@ class FastDmModel:
         # ===== Group save attributes ===== #
         self.save = {'ctl': True,
                      'cdf': True,
-                     'dens': True}
+                     'dens': True,
+                     'npz': False}
 
         # ===== Group simulation attributes ===== #
         self.simParameters = OrderedDict([
@@ -72,7 +86,8 @@ class FastDmModel:
                            'precision': 4.0,
                            'ntrials': 500,
                            'nsamples': 1,
-                           'determ': False}
+                           'determ': False,
+                           'seed': None}
 
     def dataFilesLoaded(self):
         """Helper method to indicate whether data files loaded."""
@@ -95,12 +110,15 @@ class FastDmModel:
     def overwrite(self, newModel):
         """Overwrites all data members with members from newModel."""
 
+        # Sessions saved by older versions may lack newer keys, so start from defaults
+        defaults = FastDmModel()
+
         self.parameters = copy.deepcopy(newModel.parameters)
-        self.computation = copy.deepcopy(newModel.computation)
-        self.session = copy.deepcopy(newModel.session)
-        self.plot = copy.deepcopy(newModel.plot)
-        self.save = copy.deepcopy(newModel.save)
+        self.computation = dict(defaults.computation, **copy.deepcopy(newModel.computation))
+        self.session = dict(defaults.session, **copy.deepcopy(newModel.session))
+        self.plot = dict(defaults.plot, **copy.deepcopy(newModel.plot))
+        self.save = dict(defaults.save, **copy.deepcopy(newModel.save))
         self.simParameters = copy.deepcopy(newModel.simParameters)
-        self.simOptions = copy.deepcopy(newModel.simOptions)
+        self.simOptions = dict(defaults.simOptions, **copy.deepcopy(newModel.simOptions))
 
 
@@ -196,8 +196,17 @@ class FastDmComputationFrame(QWidget):
         self._model = model
         self._console = console
         self._methodDrop = None
+        self._backendDrop = None
         self._jobsDrop = None
         self._precisionSpin = None
+        self._resumeCheck = None
+        self._cacheCheck = None
+        self._longestCheck = None
+        self._tableCheck = None
+        self._timeoutSpin = None
+        self._retriesSpin = None
+        self._batchSpin = None
+        self._startsSpin = None
         self._checkBoxes = None
         self._maxJobs = getCpuCount(self._console)
         self._initFrame(QHBoxLayout())
@@ -236,6 +245,14 @@ class FastDmComputationFrame(QWidget):
                                      'Speed of Estimation: High (Independent on Trial Numbers)\n'
                                      'Robustness: High',
                                      Qt.ToolTipRole)
+        # Create backend combo
+        self._backendDrop = QComboBox()
+        self._backendDrop.addItems(['fast-dm', 'Native (Python)'])
+        self._backendDrop.currentIndexChanged.connect(self._onBackendChange)
+        self._backendDrop.setToolTip('Estimate with the fast-dm executable or with the built-in '
+                                     'estimator, which needs no executable and also runs on Linux/Mac')
+        self._backendDrop.setStatusTip('Estimation backend')
+
         # Create jobs combo
         self._jobsDrop = QComboBox()
         self._jobsDrop.addItems([str(i) for i in range(1, self._maxJobs + 1)])
@@ -250,11 +267,72 @@ class FastDmComputationFrame(QWidget):
                                        'that are calculated accurately  ')
         self._precisionSpin.setStatusTip('Precision of calculation')
 
+        # Create resume checkbox
+        self._resumeCheck = QCheckBox()
+        self._resumeCheck.toggled[bool].connect(partial(self._onComputationToggle, 'resume'))
+        self._resumeCheck.setToolTip('Continue the run in the given output directory, '
+                                     'skipping data sets already estimated with the same settings')
+        self._resumeCheck.setStatusTip('Resume a previous run')
+
+        # Create cache checkbox
+        self._cacheCheck = QCheckBox()
+        self._cacheCheck.toggled[bool].connect(partial(self._onComputationToggle, 'cache'))
+        self._cacheCheck.setToolTip('Reuse estimates of data sets already estimated with '
+                                    'identical data and settings in an earlier session')
+        self._cacheCheck.setStatusTip('Reuse cached estimates')
+
+        # Create scheduling checkbox
+        self._longestCheck = QCheckBox()
+        self._longestCheck.toggled[bool].connect(partial(self._onComputationToggle, 'longestfirst'))
+        self._longestCheck.setToolTip('Start data sets with many trials first, '
+                                      'so no single large data set delays the end of the run')
+        self._longestCheck.setStatusTip('Schedule longest data sets first')
+
+        # Create lookup table checkbox
+        self._tableCheck = QCheckBox()
+        self._tableCheck.toggled[bool].connect(partial(self._onComputationToggle, 'cdftable'))
+        self._tableCheck.setToolTip('Native backend only: interpolate predicted CDFs of KS and CS from a '
+                                    'precomputed table (built once, shared by all runs)')
+        self._tableCheck.setStatusTip('Use CDF lookup table')
+
+        # Create timeout spin, 0 means no limit
+        self._timeoutSpin = QSpinBox()
+        self._timeoutSpin.setRange(0, 86400)
+        self._timeoutSpin.setSpecialValueText('None')
+        self._timeoutSpin.valueChanged.connect(partial(self._onComputationToggle, 'timeout'))
+        self._timeoutSpin.setToolTip('Seconds after which the estimation of a single data set is stopped')
+        self._timeoutSpin.setStatusTip('Time limit per data set')
+
+        # Create retries spin
+        self._retriesSpin = QSpinBox()
+        self._retriesSpin.setRange(0, 10)
+        self._retriesSpin.valueChanged.connect(partial(self._onComputationToggle, 'retries'))
+        self._retriesSpin.setToolTip('Number of times a failed data set is estimated again, '
+                                     'before it is skipped and reported')
+        self._retriesSpin.setStatusTip('Retries per failed data set')
+
+        # Create batch size spin
+        self._batchSpin = QSpinBox()
+        self._batchSpin.setRange(1, 1000)
+        self._batchSpin.valueChanged.connect(partial(self._onComputationToggle, 'batchsize'))
+        self._batchSpin.setToolTip('Number of data sets the native backend estimates together '
+                                   'in one vectorized optimization (per CPU core)')
+        self._batchSpin.setStatusTip('Data sets per batch (native backend)')
+
+        # Create multi-start spin
+        self._startsSpin = QSpinBox()
+        self._startsSpin.setRange(1, 100)
+        self._startsSpin.valueChanged.connect(partial(self._onComputationToggle, 'starts'))
+        self._startsSpin.setToolTip('Native backend only: number of optimizations per data set from spread-out '
+                                    'starting values, the best one is kept')
+        self._startsSpin.setStatusTip('Starts per data set (native backend)')
+
         # Create checkboxes
         self._checkBoxes = self._createCheckBoxes(['Save Control File',
                                                    'Calculate CDFs',
-                                                   'Calculate Density'],
-                                                  ['ctl', 'cdf', 'dens'])
+                                                   'Calculate Density',
+                                                   'Save Binary Estimates'],
+                                                  ['ctl', 'cdf', 'dens', 'npz'])
         # Configure additional checkboxes box
         for box in self._checkBoxes:
             checkLayout.addWidget(box)
@@ -267,6 +345,24 @@ class FastDmComputationFrame(QWidget):
         boxLayout.addWidget(self._jobsDrop, 1, 1)
         boxLayout.addWidget(QLabel('Precision'), 2, 0)
         boxLayout.addWidget(self._precisionSpin, 2, 1)
+        boxLayout.addWidget(QLabel('Resume Run'), 3, 0)
+        boxLayout.addWidget(self._resumeCheck, 3, 1)
+        boxLayout.addWidget(QLabel('Use Cache'), 4, 0)
+        boxLayout.addWidget(self._cacheCheck, 4, 1)
+        boxLayout.addWidget(QLabel('Longest First'), 5, 0)
+        boxLayout.addWidget(self._longestCheck, 5, 1)
+        boxLayout.addWidget(QLabel('Timeout (s)'), 6, 0)
+        boxLayout.addWidget(self._timeoutSpin, 6, 1)
+        boxLayout.addWidget(QLabel('Retries'), 7, 0)
+        boxLayout.addWidget(self._retriesSpin, 7, 1)
+        boxLayout.addWidget(QLabel('Backend'), 8, 0)
+        boxLayout.addWidget(self._backendDrop, 8, 1)
+        boxLayout.addWidget(QLabel('Batch Size'), 9, 0)
+        boxLayout.addWidget(self._batchSpin, 9, 1)
+        boxLayout.addWidget(QLabel('CDF Lookup Table'), 10, 0)
+        boxLayout.addWidget(self._tableCheck, 10, 1)
+        boxLayout.addWidget(QLabel('Starts'), 11, 0)
+        boxLayout.addWidget(self._startsSpin, 11, 1)
         groupBox.setLayout(boxLayout)
 
         # Configure main layout
@@ -296,6 +392,13 @@ class FastDmComputationFrame(QWidget):
         # Modify save flag
         tracksave.saved = False
 
+    def _onBackendChange(self, idx):
+        """Sets the estimation backend into the model."""
+
+        self._model.computation['backend'] = 'fastdm' if idx == 0 else 'native'
+        # Modify save flag
+        tracksave.saved = False
+
     def _onJobsChange(self, idx):
         """Sets tje jobs number."""
 
@@ -310,6 +413,13 @@ class FastDmComputationFrame(QWidget):
         # Modify save flag
         tracksave.saved = False
 
+    def _onComputationToggle(self, key, value):
+        """Sets a computation option."""
+
+        self._model.computation[key] = value
+        # Modify save flag
+        tracksave.saved = False
+
     def _onToggle(self, key, checked):
         """Changes save option."""
 
@@ -324,6 +434,7 @@ class FastDmComputationFrame(QWidget):
         self._checkBoxes[0].setChecked(self._model.save['ctl'])
         self._checkBoxes[1].setChecked(self._model.save['cdf'])
         self._checkBoxes[2].setChecked(self._model.save['dens'])
+        self._checkBoxes[3].setChecked(self._model.save['npz'])
 
         # Update method
         if self._model.computation['method'] == 'ml':
@@ -333,12 +444,27 @@ class FastDmComputationFrame(QWidget):
         else:
             self._methodDrop.setCurrentIndex(2)
 
+        # Update backend
+        self._backendDrop.setCurrentIndex(0 if self._model.computation['backend'] == 'fastdm' else 1)
+
         # Update jobs, -1, since indices begin with 0
         self._jobsDrop.setCurrentIndex(self._model.computation['jobs']-1)
 
         # Update precision
         self._precisionSpin.setValue(self._model.computation['precision'])
 
+        # Update resume, cache and scheduling
+        self._resumeCheck.setChecked(self._model.computation['resume'])
+        self._cacheCheck.setChecked(self._model.computation['cache'])
+        self._longestCheck.setChecked(self._model.computation['longestfirst'])
+        self._tableCheck.setChecked(self._model.computation['cdftable'])
+
+        # Update failure handling
+        self._timeoutSpin.setValue(self._model.computation['timeout'])
+        self._retriesSpin.setValue(self._model.computation['retries'])
+        self._batchSpin.setValue(self._model.computation['batchsize'])
+        self._startsSpin.setValue(self._model.computation['starts'])
+
 
 class FastDmExecuteFrame(QWidget):
 
@@ -354,12 +480,9 @@ class FastDmExecuteFrame(QWidget):
             self._progress = None
             self._runHandler = None
             self._runThread = None
-            self._cdfHandler = None
-            self._cdfThread = None
 
             self._initFrame(QHBoxLayout())
             self._initRunHandler()
-            self._initCdfHanlder()
 
         def _initFrame(self, layout):
             """Create buttons and configure frame."""
@@ -412,23 +535,6 @@ class FastDmExecuteFrame(QWidget):
             self._runThread.started.connect(self._runHandler.run)
             self._runThread.finished.connect(self._onRunFinished)
 
-        def _initCdfHanlder(self):
-            """Called when frame initialized, initializes a cdf handler."""
-
-            # Create a persistent model handler instance
-            self._cdfHandler = FastDmCdfHanlder(self._model)
-            # Create a persistent thread instance
-            self._cdfThread = QThread()
-            # Move handler to thread (essentially moving run method)
-            self._cdfHandler.moveToThread(self._cdfThread)
-            # Connect signals of cdf handler to thread methods
-            self._cdfHandler.finished.connect(self._cdfThread.quit)
-            self._cdfHandler.calculationStarting.connect(self._onCdfStarting)
-            self._cdfHandler.consoleLog.connect(self._onErrorLog)
-            # Connect thread signals to cdf methods
-            self._cdfThread.started.connect(self._cdfHandler.run)
-            self._cdfThread.finished.connect(self._onCdfFinished)
-
         def _onRunStarting(self):
             """Prepare buttons and progressbar for running."""
 
@@ -450,13 +556,21 @@ class FastDmExecuteFrame(QWidget):
                 self._console.writeError('\n----- ESTIMATION ABORTED DUE TO ERROR -----')
 
             else:
+                # Warn about data sets which could not be estimated
+                if self._runHandler.failures:
+                    self._console.writeWarning('\n{} data set(s) could not be estimated: {}'.format(
+                        len(self._runHandler.failures),
+                        ', '.join(failure[0] for failure in self._runHandler.failures)))
                 # Save control file, if specified
                 self._saveCtl()
-                # Calculate cdf, if specified by user
-                if not self._model.save['cdf']:
-                    self._console.write('\n----- ESTIMATION FINISHED -----')
-                else:
-                    self._calculateCdf()
+                # Cdfs and densities were calculated along with the estimates, if specified by user
+                if self._model.save['cdf']:
+                    self._console.write('Cdf values stored in ' + self._model.session['outputdir'] + '/' +
+                                        self._model.session['sessionname'] + '/' + CDFDIR)
+                if self._model.save['dens']:
+                    self._console.write('Density values stored in ' + self._model.session['outputdir'] + '/' +
+                                        self._model.session['sessionname'] + '/' + DENSITYDIR)
+                self._console.write('\n----- ESTIMATION FINISHED -----')
 
             # Reset buttons and all
             self._flag['run'] = False
@@ -469,26 +583,6 @@ class FastDmExecuteFrame(QWidget):
             # Set max of progressbar (since processes not writing correctly)
             QTimer.singleShot(5000, self._hideProgress)
 
-        def _onCdfStarting(self):
-            """Give verbose to user. Process very fast, so run right away."""
-
-            # So fast that this isn't event necessary
-            pass
-
-        def _onCdfFinished(self):
-            """Give verbose to user."""
-
-            self._console.write('Cdf values stored in ' + self._model.session['outputdir'] + '/' +
-                                self._model.session['sessionname'] + '/' + CDFDIR)
-            self._console.write('\n----- ESTIMATION FINISHED -----')
-
-        def _calculateCdf(self):
-            """Called only if user did not abort run."""
-
-            # If user has specified save cdf, predict and calc cdfs
-            if self._model.save['cdf']:
-                self._cdfThread.start()
-
         def _saveCtl(self):
             """Saves a control file, if specified."""
 
@@ -529,6 +623,8 @@ class FastDmExecuteFrame(QWidget):
             """Sets run flag to stop, thus notifying fast-dm thread to abort."""
 
             self._flag['run'] = False
+            # Wake up the run handler right away
+            self._runHandler.abort()
 
 
 class FastDmImageFrame(QWidget):
@@ -795,6 +891,8 @@ class FastDmExecuteFrameSim(QWidget):
         """Set run flag to stop and notify simulation to abort."""
 
         self._flag['run'] = False
+        # Wake up the simulation handler right away
+        self._simHandler.abort()
 
     def _onSimStarting(self):
         """Called when simulation starting signal emitted from sim thread."""
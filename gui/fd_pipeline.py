@@ -0,0 +1,155 @@
+import collections
+import time
+
+
+class FastDmPipeline:
+
+    def __init__(self, log=None):
+        """
+        Creates an empty dependency graph of the stages of all data sets. Nodes are keyed
+        by (stage, index) and are either tasks (function, arguments) run by a pool, or
+        external, i.e. finished by the caller (e.g. the estimate of a data set). A task is
+        handed to the pool as soon as all nodes it depends on are finished, so the stages
+        of different data sets interleave. A failed node drops all nodes depending on it.
+        Log lines are passed to log(str).
+        """
+
+        self._log = log if log is not None else _discard
+        # Task nodes as key -> (function, arguments)
+        self._tasks = {}
+        # Names of data sets as key -> name, used in log lines
+        self._names = {}
+        # Nodes waiting for others as key -> number of unfinished dependencies
+        self._waiting = {}
+        # Nodes to release as key -> list of keys depending on it
+        self._dependents = collections.defaultdict(list)
+        # Tasks whose dependencies are all finished, in order of release
+        self._ready = collections.deque()
+        # Number of finished, failed and dropped nodes of each stage
+        self._counts = {'finished': collections.Counter(),
+                        'failed': collections.Counter(),
+                        'skipped': collections.Counter()}
+        self._started = time.time()
+
+    def __contains__(self, key):
+        """True if key is a task of the pipeline (as opposed to a key of another job)."""
+
+        return key in self._tasks
+
+    def __len__(self):
+        """Returns the number of tasks of the pipeline."""
+
+        return len(self._tasks)
+
+    def add(self, key, task=None, after=(), name=None):
+        """
+        Adds node key, run as task (function, arguments) after all nodes in after are
+        finished. A node without a task is external, see done and fail. Nodes must be
+        added after the nodes they depend on.
+        """
+
+        self._names[key] = name if name is not None else str(key[1])
+        if task is not None:
+            self._tasks[key] = task
+        after = list(after)
+        for other in after:
+            self._dependents[other].append(key)
+        if after:
+            self._waiting[key] = len(after)
+        elif task is not None:
+            self._ready.append(key)
+
+    def done(self, key):
+        """Marks node key as finished, releases tasks which waited only for it."""
+
+        self._counts['finished'][key[0]] += 1
+        for other in self._dependents.pop(key, []):
+            if other not in self._waiting:
+                continue
+            self._waiting[other] -= 1
+            if not self._waiting[other]:
+                del self._waiting[other]
+                self._ready.append(other)
+
+    def fail(self, key):
+        """Marks node key as failed, drops all nodes depending on it (directly or not)."""
+
+        self._counts['failed'][key[0]] += 1
+        self._waiting.pop(key, None)
+        self._skip(key)
+
+    def jobs(self, source=()):
+        """
+        Generates (key, args) pairs for a pool, ready tasks first, then the jobs of source
+        (e.g. estimates, which release further tasks when finished). Yields None while tasks
+        still wait for running jobs, the pool then asks again after the next event.
+        """
+
+        source = iter(source)
+        while True:
+            if self._ready:
+                key = self._ready.popleft()
+                yield key, self._tasks[key]
+                continue
+            if source is not None:
+                try:
+                    job = next(source)
+                except StopIteration:
+                    source = None
+                    continue
+                yield job
+                continue
+            if not self._waiting:
+                return
+            yield None
+
+    def pending(self):
+        """Returns the number of tasks which are not finished yet (waiting or ready)."""
+
+        return len(self._waiting) + len(self._ready)
+
+    def onFinished(self, key, returncode, log):
+        """Called by the pool each time a task has finished, tasks are not run again."""
+
+        if returncode == 0:
+            self.done(key)
+            return
+
+        # Tasks report errors in their last line, see fd_process_pool._runTask
+        if returncode is None:
+            reason = 'Timed out'
+        else:
+            reason = log.strip().splitlines()[-1] if log.strip() else 'Exited with code {}'.format(returncode)
+        self._log('[{}] Could not calculate {}: {}'.format(self._names[key], key[0], reason))
+        self.fail(key)
+
+    def onOutput(self, key, line):
+        """Called by the pool for each line a task writes."""
+
+        self._log(line)
+
+    def summary(self):
+        """Returns a line summing up the nodes of each stage."""
+
+        parts = []
+        for state in ('finished', 'failed', 'skipped'):
+            counts = self._counts[state]
+            if counts:
+                parts.append('{} {}'.format(state, ', '.join('{} {}'.format(counts[stage], stage)
+                                                               for stage in sorted(counts))))
+        return 'Pipeline {} after {:.1f} seconds.'.format('; '.join(parts) or 'empty',
+                                                          time.time() - self._started)
+
+    def _skip(self, key):
+        """Drops all nodes depending on key."""
+
+        for other in self._dependents.pop(key, []):
+            if self._waiting.pop(other, None) is not None:
+                self._counts['skipped'][other[0]] += 1
+                self._skip(other)
+
+
+def _discard(*args):
+    """Default callback, ignores everything passed to it."""
+
+    pass
@@ -4,8 +4,11 @@ from PyQt5.QtCore import Qt, QThread, QObject, pyqtSignal
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from fd_dialogs import FastDmLoading
+from fd_engine import BUNDLE_SUFFIX
 import matplotlib.pyplot as plt
 import numpy as np
+import json
+import os
 import tracksave
 
 
@@ -21,6 +24,8 @@ class FastDmPlotter(QObject):
         self.figure = figure
         self.canvas = canvas
         self.fileIndexes = None
+        # Opened bundles as index file name -> (modification time, curves, index)
+        self._bundles = {}
 
     def run(self):
         """The method that is run in a separate thread."""
@@ -43,15 +48,12 @@ class FastDmPlotter(QObject):
             # Add subplot
             ax = self.figure.add_subplot(rows, cols, subi + 1)
 
-            # Load data and unpack it neatly without nans
-            data = np.genfromtxt(self._model.plot['cdffiles'][idx], skip_header=True)
-            empX = data[:, 0][~np.isnan(data[:, 0])]
-            empY = data[:, 1][~np.isnan(data[:, 1])]
-            predX = data[:, 2][~np.isnan(data[:, 2])]
-            predY = data[:, 3][~np.isnan(data[:, 3])]
+            # Load data (from a bundle if possible), whether cdfs or densities
+            density, empX, empY, predX, predY = self._loadCurves(self._model.plot['cdffiles'][idx])
 
-            # Set y axes ticks
-            ax.yaxis.set_ticks([0.2, 0.4, 0.6, 0.8, 1.0])
+            # Set y axes ticks (cdfs only, densities have no upper limit)
+            if not density:
+                ax.yaxis.set_ticks([0.2, 0.4, 0.6, 0.8, 1.0])
 
             # Change color of axes
             # ax.set_facecolor('#686868')
@@ -72,10 +74,11 @@ class FastDmPlotter(QObject):
 
             # Add text (which participant)
             ax.text(np.max(empX) / 2 if np.max(empX) > np.max(predX) else np.max(predX) / 2,
-                    0.5, self._model.plot['cdffiles'][idx].split('/')[-1], size=12)
+                    0.5 * np.max(predY) if density else 0.5,
+                    self._model.plot['cdffiles'][idx].split('/')[-1], size=12)
 
-            # # Plot data
-            ax.plot(empX, empY, label='Empirical', linestyle='-')
+            # # Plot data, binned empirical densities as steps
+            ax.plot(empX, empY, label='Empirical', linestyle='-', drawstyle='steps-mid' if density else 'default')
             ax.plot(predX, predY, label='Predicted', linestyle='--')
 
             # # Set legend
@@ -92,6 +95,48 @@ class FastDmPlotter(QObject):
         # Refresh canvas
         self.canvas.draw()
 
+    def _loadCurves(self, fileName):
+        """
+        Returns (density, empX, empY, predX, predY) of a plot file. Files written by a run are
+        sliced out of the memory-mapped bundle of their directory, others are parsed as text.
+        """
+
+        index, curves = self._openBundle(fileName)
+        name = fileName.split('/')[-1]
+        if index is not None and name in index['curves']:
+            empStart, empStop = index['curves'][name]['empirical']
+            predStart, predStop = index['curves'][name]['predicted']
+            return (index['plot'] == 'density-plot', curves[0, empStart:empStop], curves[1, empStart:empStop],
+                    curves[0, predStart:predStop], curves[1, predStart:predStop])
+
+        # Parse text and unpack it neatly without nans, the header flags cdfs or densities
+        with open(fileName, 'r') as infile:
+            density = 'density-plot' in infile.readline()
+            data = np.genfromtxt(infile)
+        return (density, data[:, 0][~np.isnan(data[:, 0])], data[:, 1][~np.isnan(data[:, 1])],
+                data[:, 2][~np.isnan(data[:, 2])], data[:, 3][~np.isnan(data[:, 3])])
+
+    def _openBundle(self, fileName):
+        """
+        Returns (index, curves) of the bundle next to a plot file, (None, None) if there is
+        none or it is older than the file. Bundles are opened once and memory-mapped.
+        """
+
+        directory = os.path.dirname(fileName)
+        indexName = directory + '/' + os.path.basename(directory) + BUNDLE_SUFFIX + '.json'
+        try:
+            modified = os.path.getmtime(indexName)
+            if modified < os.path.getmtime(fileName):
+                return None, None
+            if indexName not in self._bundles or self._bundles[indexName][0] != modified:
+                with open(indexName, 'r') as indexFile:
+                    index = json.load(indexFile)
+                curves = np.load(indexName[:-len('.json')] + '.npy', mmap_mode='r')
+                self._bundles[indexName] = (modified, curves, index)
+        except (OSError, ValueError):
+            return None, None
+        return self._bundles[indexName][2], self._bundles[indexName][1]
+
     def _getNumSubPlots(self):
         """Determines the number of subplots to be drawn."""
 
@@ -205,7 +250,7 @@ class FastDmPlotDataViewer(QListWidget):
                 if self._headerOk(file):
                     new.append(file)
                 else:
-                    self._console.writeError('Could not load ' + file + " Header 'cdf-plot' missing.")
+                    self._console.writeError('Could not load ' + file + " Header 'cdf-plot' or 'density-plot' missing.")
             else:
                 self._console.writeError('Could not load ' + file + " File already loaded.")
         # Update cdf files in model
@@ -214,10 +259,11 @@ class FastDmPlotDataViewer(QListWidget):
         self.updateFilesList(new)
 
     def _headerOk(self, file):
-        """Tests if the header of the plot file contains the plot-cdf flag."""
+        """Tests if the header of the plot file contains the cdf-plot or density-plot flag."""
 
         with open(file, 'r') as infile:
-            if 'cdf-plot' not in infile.readline():
+            header = infile.readline()
+            if 'cdf-plot' not in header and 'density-plot' not in header:
                 return False
             return True
 
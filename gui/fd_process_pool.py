@@ -0,0 +1,376 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+
+
+"""Maximum time (seconds) the pool sleeps without checking the run flag."""
+ABORT_LATENCY = 0.1
+
+"""Event types posted to the pool's event queue."""
+OUTPUT = 'output'
+EXITED = 'exited'
+ABORTED = 'aborted'
+
+"""Return value of onFinished callbacks asking to run the same job once more."""
+RETRY = 'retry'
+
+"""Seconds a task of a dead worker process is waited for, its result may still be on the way."""
+WORKER_LOST_GRACE = 1.0
+
+"""In worker processes of a FastDmTaskPool, the queue tasks announce their worker on."""
+_started = None
+
+
+class FastDmProcessPool:
+
+    def __init__(self, nJobs, flag, timeout=None):
+        """
+        Creates a new pool which runs at most nJobs child processes at once.
+        Each child is supervised by a watcher thread reading its output pipe, so
+        the pool itself sleeps until a child writes, exits or an abort is requested.
+        Children running longer than timeout seconds (if given) are killed.
+        """
+
+        self._nJobs = nJobs
+        self._flag = flag
+        self._timeout = timeout
+        self._events = queue.Queue()
+        self.aborted = False
+
+    def run(self, jobs, onFinished, onOutput=None):
+        """
+        Runs all jobs given as an iterable of (key, args) pairs. The iterable is
+        consumed lazily, i.e. only when a slot is free, and may yield None if no job
+        is ready yet (e.g. waits for a running one), it is asked again after the next
+        event. Args are a fast-dm command line or a pair (function, arguments) of a
+        python task (see FastDmTaskPool), which runs in a thread of this process. Calls onOutput(key, line) for
+        each line a job writes to stdout or stderr, as soon as it arrives, and
+        onFinished(key, returncode, log) for each finished job with its whole log.
+        The returncode is None, if the job was killed for exceeding the timeout.
+        If onFinished returns RETRY, the job is run again before any new job,
+        if it returns False, all remaining jobs are killed.
+        Returns True if all jobs were run, False if aborted or stopped.
+        """
+
+        # Running jobs as key -> dict with process, args, log lines and start time
+        running = {}
+        # Jobs to be run again as (key, args) pairs
+        retries = collections.deque()
+        jobs = iter(jobs)
+        exhausted = False
+
+        while True:
+
+            # Fill up all free slots with jobs to retry first, then with pending jobs
+            while len(running) < self._nJobs:
+                if retries:
+                    key, args = retries.popleft()
+                elif not exhausted:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    # No job ready yet, ask again after the next event
+                    if job is None:
+                        break
+                    key, args = job
+                else:
+                    break
+                running[key] = self._spawn(key, args)
+
+            # Nothing left to do
+            if exhausted and not retries and not running:
+                return True
+
+            # Sleep until something happens (or the abort latency has passed)
+            try:
+                event, key, payload = self._events.get(timeout=ABORT_LATENCY)
+            except queue.Empty:
+                event = None
+
+            # Check if user has aborted, either by event or by flag
+            if event == ABORTED or not self._flag['run']:
+                self.aborted = True
+                self._killAll(running)
+                return False
+
+            # Kill children which have exceeded the time limit, their exit is handled below
+            self._killTimedOut(running)
+
+            # Handle a new line of output, collect it for the final log
+            if event == OUTPUT:
+                running[key]['lines'].append(payload)
+                if onOutput is not None:
+                    onOutput(key, payload)
+
+            # Handle a finished child
+            elif event == EXITED:
+                child = running.pop(key)
+                returncode = None if child['timedout'] else payload
+                # Let caller decide whether to go on
+                decision = onFinished(key, returncode, '\n'.join(child['lines']))
+                if decision is False:
+                    self._killAll(running)
+                    return False
+                if decision == RETRY:
+                    retries.append((key, child['args']))
+
+    def abort(self):
+        """Requests an abort. Thread-safe, wakes up the pool immediately."""
+
+        self._events.put((ABORTED, None, None))
+
+    def _spawn(self, key, args):
+        """Spawns a child process and a watcher thread for it."""
+
+        # Python tasks run in a thread instead, they cannot be killed
+        if isinstance(args, tuple):
+            worker = threading.Thread(target=self._call, args=(key, args), daemon=True)
+            worker.start()
+            return {'process': None, 'args': args, 'lines': [], 'started': time.time(), 'timedout': False}
+
+        # Spawn process with stderr merged into a stdout pipe
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # Create a watcher which blocks on the pipe and the child (does not consume CPU)
+        watcher = threading.Thread(target=self._watch, args=(key, p), daemon=True)
+        watcher.start()
+        return {'process': p, 'args': args, 'lines': [], 'started': time.time(), 'timedout': False}
+
+    def _watch(self, key, p):
+        """
+        Run in a watcher thread, posts each output line as soon as it is
+        written and an exit event after the child has closed its pipe.
+        """
+
+        with p.stdout:
+            for line in p.stdout:
+                self._events.put((OUTPUT, key, line.decode('utf-8', 'replace').rstrip('\r\n')))
+        returncode = p.wait()
+        self._events.put((EXITED, key, returncode))
+
+    def _call(self, key, args):
+        """Run in a worker thread, posts the log of a python task line by line and its exit."""
+
+        returncode, log = _runTask(*args)
+        for line in log.splitlines():
+            self._events.put((OUTPUT, key, line))
+        self._events.put((EXITED, key, returncode))
+
+    def _killTimedOut(self, running):
+        """Kills all children running longer than the timeout."""
+
+        if not self._timeout:
+            return
+
+        now = time.time()
+        for child in running.values():
+            if child['process'] is not None and not child['timedout'] and \
+                    now - child['started'] > self._timeout:
+                child['timedout'] = True
+                child['process'].kill()
+
+    def _killAll(self, running):
+        """Kills all running children."""
+
+        for child in running.values():
+            # Threads of python tasks finish on their own, their results are ignored
+            if child['process'] is None:
+                continue
+            child['process'].kill()
+            # Wait for the process to actually die, so its files can be removed
+            child['process'].wait()
+        running.clear()
+
+
+class FastDmTaskPool:
+
+    def __init__(self, nJobs, flag, timeout=None):
+        """
+        Creates a new pool which runs python functions in nJobs worker processes,
+        which are started once and reused for all jobs. Has the same interface as
+        FastDmProcessPool, but each job's args are a pair (function, arguments) of a
+        picklable module level function returning (returncode, log). A task exceeding
+        timeout is stopped by killing its worker process, which the pool replaces,
+        the other tasks run on. A task whose worker process dies (e.g. crashes or
+        runs out of memory) fails with returncode 1.
+        """
+
+        self._nJobs = nJobs
+        self._flag = flag
+        self._timeout = timeout
+        self._events = queue.Queue()
+        # Distinguishes results of a task from those of earlier runs of the same key
+        self._tokens = itertools.count()
+        self.aborted = False
+
+    def run(self, jobs, onFinished, onOutput=None):
+        """
+        Runs all jobs given as an iterable of (key, (function, arguments)) pairs (or None
+        if no job is ready yet), see FastDmProcessPool.run. The log of a task is passed to
+        onOutput line by line after the task has finished.
+        """
+
+        # Running jobs as key -> dict with args, token, start time and worker process id
+        running = {}
+        # Jobs to be run again as (key, args) pairs
+        retries = collections.deque()
+        jobs = iter(jobs)
+        exhausted = False
+        # Tasks post (token, process id) when a worker starts them
+        started = multiprocessing.SimpleQueue()
+        workers = multiprocessing.Pool(self._nJobs, _initWorker, (started,))
+
+        try:
+            while True:
+
+                # Fill up all free slots with jobs to retry first, then with pending jobs
+                while len(running) < self._nJobs:
+                    if retries:
+                        key, args = retries.popleft()
+                    elif not exhausted:
+                        try:
+                            job = next(jobs)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        # No job ready yet, ask again after the next event
+                        if job is None:
+                            break
+                        key, args = job
+                    else:
+                        break
+                    running[key] = self._submit(workers, key, args)
+
+                # Nothing left to do
+                if exhausted and not retries and not running:
+                    return True
+
+                # Sleep until something happens (or the abort latency has passed)
+                try:
+                    event, key, payload = self._events.get(timeout=ABORT_LATENCY)
+                except queue.Empty:
+                    event = None
+
+                # Check if user has aborted, either by event or by flag
+                if event == ABORTED or not self._flag['run']:
+                    self.aborted = True
+                    return False
+
+                # Collect finished tasks as (key, returncode, log), ignore results of tasks run before a restart
+                finished = []
+                if event == EXITED and key in running and payload[0] == running[key]['token']:
+                    finished.append((key,) + payload[1:])
+
+                # Kill the workers of tasks which have exceeded the time limit, the pool replaces them
+                self._learnWorkers(running, started)
+                timedOut = [other for other in self._timedOut(running) if other != key or not finished]
+                for other in timedOut:
+                    _kill(running[other]['pid'])
+                finished.extend((other, None, '') for other in timedOut)
+
+                # Fail tasks whose worker has died, their result never arrives
+                finished.extend(lost for lost in self._lost(running)
+                                if lost[0] not in [other[0] for other in finished])
+
+                for key, returncode, log in finished:
+                    task = running.pop(key)
+                    if onOutput is not None:
+                        for line in log.splitlines():
+                            onOutput(key, line)
+                    # Let caller decide whether to go on
+                    decision = onFinished(key, returncode, log)
+                    if decision is False:
+                        return False
+                    if decision == RETRY:
+                        retries.append((key, task['args']))
+        finally:
+            workers.terminate()
+            workers.join()
+
+    def abort(self):
+        """Requests an abort. Thread-safe, wakes up the pool immediately."""
+
+        self._events.put((ABORTED, None, None))
+
+    def _submit(self, workers, key, args):
+        """Hands a task to the workers, its result is posted to the event queue."""
+
+        token = next(self._tokens)
+        function, arguments = args
+        workers.apply_async(_runTask, (function, arguments, token),
+                            callback=lambda result: self._events.put((EXITED, key, (token,) + tuple(result))),
+                            error_callback=lambda e: self._events.put(
+                                (EXITED, key, (token, 1, 'error: {}: {}'.format(type(e).__name__, e)))))
+        return {'args': args, 'token': token, 'started': time.time(), 'pid': None, 'lost': None}
+
+    def _learnWorkers(self, running, started):
+        """Learns from the queue of started tasks which worker process runs which task."""
+
+        while not started.empty():
+            token, pid = started.get()
+            for task in running.values():
+                if task['token'] == token:
+                    task['pid'] = pid
+
+    def _lost(self, running):
+        """Returns (key, returncode, log) of all running tasks whose worker process has died."""
+
+        # Workers which died are replaced by the pool, so they are no longer among the children
+        alive = {child.pid for child in multiprocessing.active_children()}
+        now = time.time()
+        lost = []
+        for key, task in running.items():
+            if task['pid'] is None or task['pid'] in alive:
+                continue
+            if task['lost'] is None:
+                task['lost'] = now
+            elif now - task['lost'] > WORKER_LOST_GRACE:
+                lost.append((key, 1, 'error: worker process died'))
+        return lost
+
+    def _timedOut(self, running):
+        """Returns the keys of all tasks running longer than the timeout, whose worker is known."""
+
+        if not self._timeout:
+            return []
+
+        now = time.time()
+        return [key for key, task in running.items()
+                if task['pid'] is not None and now - task['started'] > self._timeout]
+
+
+def _kill(pid):
+    """Kills a worker process of a FastDmTaskPool, if it has not exited already."""
+
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def _initWorker(started):
+    """Run once in each worker process of a FastDmTaskPool, keeps the queue tasks announce their worker on."""
+
+    global _started
+    _started = started
+
+
+def _runTask(function, arguments, token=None):
+    """
+    Runs in a worker process (or a thread of FastDmProcessPool), announces the worker
+    of a FastDmTaskPool task and reports exceptions as a failed task instead of stopping the pool.
+    """
+
+    if token is not None and _started is not None:
+        _started.put((token, os.getpid()))
+    try:
+        return function(*arguments)
+    except Exception as e:
+        return 1, 'error: {}: {}'.format(type(e).__name__, e)
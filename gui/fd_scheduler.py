@@ -0,0 +1,102 @@
+import json
+import os
+
+
+"""Relative cost of a single trial per method (cs works on bins, so hardly depends on trials)."""
+TRIAL_COST = {'ml': 1.0, 'ks': 0.5, 'cs': 0.01}
+
+"""Growth of the cost with each additional digit of precision."""
+PRECISION_GROWTH = 1.5
+
+"""Name of the file storing timings of past runs."""
+TIMINGS_NAME = 'timings.json'
+
+
+class FastDmTimings:
+
+    def __init__(self, directory, backend='fastdm'):
+        """
+        Creates a store of fit times of past runs with the given backend ('fastdm' or
+        'native'), kept per backend, method and precision as running sums of a least
+        squares line (seconds over number of trials).
+        """
+
+        self._fileName = directory + '/' + TIMINGS_NAME
+        self._backend = backend
+        self._sums = {}
+
+        if os.path.isfile(self._fileName):
+            try:
+                with open(self._fileName, 'r') as infile:
+                    self._sums = json.load(infile)
+            except ValueError:
+                # Corrupted file, start over
+                self._sums = {}
+
+    def record(self, method, precision, trials, seconds):
+        """Adds the fit time of a single data set."""
+
+        sums = self._sums.setdefault(self._key(self._backend, method, precision), [0, 0.0, 0.0, 0.0, 0.0])
+        sums[0] += 1
+        sums[1] += trials
+        sums[2] += seconds
+        sums[3] += trials * trials
+        sums[4] += trials * seconds
+
+    def predict(self, method, precision, trials):
+        """Returns the predicted fit time in seconds, None if nothing recorded yet."""
+
+        sums = self._sums.get(self._key(self._backend, method, precision))
+        if sums is None:
+            return None
+
+        n, sx, sy, sxx, sxy = sums
+        denominator = n * sxx - sx * sx
+        # Not enough different trial numbers for a line, assume time per trial is constant
+        if n < 2 or denominator <= 0:
+            return sy / sx * trials if sx > 0 else sy / n
+
+        slope = (n * sxy - sx * sy) / denominator
+        intercept = (sy - slope * sx) / n
+        return max(intercept + slope * trials, 0.0)
+
+    def save(self):
+        """Writes all timings to disk."""
+
+        directory = os.path.dirname(self._fileName)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self._fileName, 'w') as outfile:
+            json.dump(self._sums, outfile)
+
+    @staticmethod
+    def _key(backend, method, precision):
+        """Returns the key under which timings of backend, method and precision are stored."""
+
+        return '{}_{}_{:.1f}'.format(backend, method, float(precision))
+
+
+def countTrials(fileName):
+    """Returns the number of trials in a data file (non-empty lines without header)."""
+
+    with open(fileName, 'rb') as infile:
+        lines = sum(1 for line in infile if line.strip())
+    return max(lines - 1, 0)
+
+
+def estimateCost(trials, method, precision, timings=None):
+    """Estimates the cost of fitting a data set, from past timings if available."""
+
+    if timings is not None:
+        predicted = timings.predict(method, precision, trials)
+        if predicted is not None:
+            return predicted
+
+    return (1.0 + TRIAL_COST.get(method, 1.0) * trials) * PRECISION_GROWTH ** float(precision)
+
+
+def longestFirst(trials, method, precision, timings=None):
+    """Returns the indices of data sets (given by their trial numbers) ordered by decreasing cost."""
+
+    costs = [estimateCost(n, method, precision, timings) for n in trials]
+    return sorted(range(len(trials)), key=lambda idx: -costs[idx])
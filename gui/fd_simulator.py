@@ -0,0 +1,106 @@
+from fd_wiener import wienerCdf
+import numpy as np
+
+
+"""Number of grid points on which the cdf of a deterministic sample is inverted."""
+DETERMINISTIC_POINTS = 20001
+
+
+def simulateDiffusion(nTrials, nSamples, a, zr, v, t0, d=0.0, szr=0.0, sv=0.0, st0=0.0, p=0.0,
+                      precision=4.0, seed=None, deterministic=False, contaminants=None):
+    """
+    Simulates nSamples data sets of nTrials trials each of the diffusion model with all
+    nine parameters (as in FastDmModel.simParameters) in one vectorized call. Returns
+    response times and responses (1 upper, 0 lower threshold) as arrays of shape
+    (nSamples, nTrials). Starting point, drift and non-decision time are drawn per trial
+    from their variability, then the process is run as a random walk with a time step
+    of 10^(1 - precision) seconds, where crossings between two steps are detected by the
+    Brownian bridge. A proportion p of trials are contaminants, uniformly distributed over
+    the range given by contaminants (default: range of the other trials) and both responses.
+    The same seed always gives the same samples. A deterministic sample, as written by
+    construct-samples without -r, holds the quantiles of the predicted distribution
+    instead, so its empirical cdf follows the predicted one as closely as possible.
+    """
+
+    if deterministic:
+        rt, response = _deterministicSample(nTrials, a, zr, v, t0, d, szr, sv, st0, p, contaminants)
+        return np.tile(rt, (nSamples, 1)), np.tile(response, (nSamples, 1))
+
+    rng = np.random.default_rng(seed)
+    n = nTrials * nSamples
+
+    # Draw variability of each trial, uniform for starting point and non-decision time
+    start = a * (zr + szr * (rng.random(n) - 0.5))
+    drift = v + sv * rng.standard_normal(n)
+    nonDecision = t0 + st0 * (rng.random(n) - 0.5)
+
+    # Run all trials at once, non-decision time depends on the response (d)
+    decisionTime, upper = _firstPassage(a, start, drift, 10.0 ** (1.0 - precision), rng)
+    rt = decisionTime + nonDecision + np.where(upper, 0.5 * d, -0.5 * d)
+    response = upper.astype(float)
+
+    # Replace a proportion p of trials by contaminants
+    if p > 0:
+        low, high = contaminants if contaminants is not None else (rt.min(), rt.max())
+        contaminated = rng.random(n) < p
+        rt[contaminated] = low + (high - low) * rng.random(contaminated.sum())
+        response[contaminated] = rng.random(contaminated.sum()) < 0.5
+
+    return rt.reshape(nSamples, nTrials), response.reshape(nSamples, nTrials)
+
+
+def _firstPassage(a, start, drift, step, rng):
+    """
+    Returns first-passage times and whether the upper threshold was hit of processes between
+    0 and a starting at start, with one drift per process. Only processes still running are
+    moved at each step, so the cost is proportional to the summed decision times.
+    """
+
+    time = np.zeros(start.shape)
+    upper = np.zeros(start.shape, dtype=bool)
+    running = np.arange(start.size)
+    position = start.copy()
+    elapsed = 0.0
+
+    while running.size:
+        elapsed += step
+        moved = position + drift[running] * step + np.sqrt(step) * rng.standard_normal(running.size)
+
+        # Crossed at the step, or in between (probability of the Brownian bridge touching a threshold)
+        with np.errstate(over='ignore'):
+            touchedLower = np.exp(-2.0 * np.maximum(position, 0.0) * np.maximum(moved, 0.0) / step)
+            touchedUpper = np.exp(-2.0 * np.maximum(a - position, 0.0) * np.maximum(a - moved, 0.0) / step)
+        chance = rng.random(running.size)
+        lower = (moved <= 0) | (chance < touchedLower)
+        hitUpper = ~lower & ((moved >= a) | (chance < touchedLower + touchedUpper))
+        finished = lower | hitUpper
+
+        # Crossing lies somewhere within the last step, take its middle
+        time[running[finished]] = elapsed - 0.5 * step
+        upper[running[hitUpper]] = True
+        running, position = running[~finished], moved[~finished]
+
+    return time, upper
+
+
+def _deterministicSample(nTrials, a, zr, v, t0, d, szr, sv, st0, p, contaminants):
+    """Returns response times and responses at the quantiles (i + 0.5) / n of the predicted distribution."""
+
+    # Contaminants range over the uncontaminated sample by default, as for random samples
+    if p > 0 and contaminants is None:
+        rt, response = _deterministicSample(nTrials, a, zr, v, t0, d, szr, sv, st0, 0.0, None)
+        contaminants = (rt.min(), rt.max())
+
+    # Extend the grid of signed response times until it holds all but a negligible mass
+    quantiles = (np.arange(nTrials) + 0.5) / nTrials
+    span = t0 + 0.5 * abs(d) + 0.5 * st0 + a * a
+    while True:
+        x = np.linspace(-span, span, DETERMINISTIC_POINTS)
+        cdf = wienerCdf(x, a, zr, v, t0, d, szr, sv, st0, p, contaminants=contaminants)[0]
+        if cdf[0] < 0.5 * quantiles[0] and cdf[-1] > 1.0 - 0.5 * quantiles[0]:
+            break
+        span *= 2.0
+
+    # Invert the cdf, which is flat around zero (no response faster than t0)
+    signed = np.interp(quantiles, np.maximum.accumulate(cdf), x)
+    return np.abs(signed), (signed > 0).astype(float)
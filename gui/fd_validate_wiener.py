@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Validates the numpy diffusion model (fd_wiener) against fast-dm. With --record, plot-cdf
+and plot-density of fast-dm are run for each parameter set of PARAMETER_SETS and their
+curves are stored as reference file. Without, densities and cdfs of fd_wiener are compared
+to the stored references (if any) and to a brute-force calculation, which integrates over
+sv, szr and st0 by dense quadrature of the plain series. Exits with 1 if any curve deviates
+more than the tolerance.
+
+Examples:
+    python fd_validate_wiener.py --record --plot-cdf fast-dm-bin/plot-cdf.exe --plot-density fast-dm-bin/plot-density.exe
+    python fd_validate_wiener.py
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from fd_wiener import wienerCdf, wienerDensity
+
+
+"""Parameter sets compared, with and without variabilities and a difference in non-decision times."""
+PARAMETER_SETS = [
+    {'a': 1.0, 'zr': 0.5, 'v': 1.0, 't0': 0.3, 'd': 0.0, 'szr': 0.0, 'sv': 0.0, 'st0': 0.0},
+    {'a': 1.5, 'zr': 0.4, 'v': -0.8, 't0': 0.4, 'd': 0.05, 'szr': 0.0, 'sv': 0.0, 'st0': 0.0},
+    {'a': 1.2, 'zr': 0.55, 'v': 2.0, 't0': 0.35, 'd': 0.0, 'szr': 0.0, 'sv': 1.0, 'st0': 0.0},
+    {'a': 0.8, 'zr': 0.5, 'v': 1.5, 't0': 0.3, 'd': 0.0, 'szr': 0.3, 'sv': 0.0, 'st0': 0.0},
+    {'a': 1.0, 'zr': 0.45, 'v': 0.5, 't0': 0.45, 'd': 0.0, 'szr': 0.0, 'sv': 0.0, 'st0': 0.2},
+    {'a': 1.4, 'zr': 0.6, 'v': 2.5, 't0': 0.3, 'd': -0.04, 'szr': 0.2, 'sv': 1.5, 'st0': 0.15},
+]
+
+"""Options of plot-cdf and plot-density for each parameter."""
+OPTIONS = {'a': '-a', 'zr': '-z', 'v': '-v', 't0': '-t', 'd': '-d', 'szr': '-Z', 'sv': '-V', 'st0': '-T'}
+
+"""Precision fast-dm calculates reference curves with."""
+REFERENCE_PRECISION = 4
+
+"""File the reference curves of fast-dm are stored in, next to this script."""
+REFERENCE_NAME = 'fd_wiener_reference.json'
+
+"""Maximum absolute deviation of cdfs, and of densities relative to their maximum."""
+CDF_TOLERANCE = 1e-3
+DENSITY_TOLERANCE = 5e-3
+
+"""Signed response times (seconds) the brute-force calculation is compared at."""
+BRUTE_FORCE_TIMES = np.linspace(-2.5, 2.5, 201)
+
+"""Quadrature nodes of the brute-force calculation over sv, szr and st0, and terms of its series."""
+BRUTE_FORCE_NODES = {'sv': 32, 'szr': 16, 'st0': 128}
+BRUTE_FORCE_TERMS = 10
+
+"""Decision times (seconds) the brute-force density is integrated over for cdfs."""
+BRUTE_FORCE_GRID = np.linspace(0.0, 8.0, 4001)
+
+
+def recordReferences(plotCdf, plotDensity, fileName):
+    """Runs plot-cdf and plot-density for each parameter set and writes their curves to fileName."""
+
+    references = []
+    for parameters in PARAMETER_SETS:
+        references.append({'parameters': parameters,
+                           'cdf': _runPlot(plotCdf, parameters),
+                           'density': _runPlot(plotDensity, parameters)})
+    with open(fileName, 'w') as outfile:
+        json.dump({'precision': REFERENCE_PRECISION, 'sets': references}, outfile)
+
+
+def compareReferences(fileName):
+    """Compares fd_wiener to the curves of fast-dm in fileName, returns a list of (label, error, ok)."""
+
+    with open(fileName, 'r') as infile:
+        references = json.load(infile)['sets']
+
+    results = []
+    for number, reference in enumerate(references, 1):
+        x, cdf = np.array(reference['cdf'])
+        results.append(_result('set {} cdf vs fast-dm'.format(number),
+                               wienerCdf(x[np.newaxis, :], **reference['parameters'])[0], cdf, CDF_TOLERANCE))
+        x, density = np.array(reference['density'])
+        results.append(_result('set {} density vs fast-dm'.format(number),
+                               wienerDensity(np.abs(x), x > 0, **reference['parameters']),
+                               density, DENSITY_TOLERANCE * density.max()))
+    return results
+
+
+def compareBruteForce():
+    """Compares fd_wiener to the brute-force calculation, returns a list of (label, error, ok)."""
+
+    results = []
+    x = BRUTE_FORCE_TIMES[BRUTE_FORCE_TIMES != 0.0]
+    for number, parameters in enumerate(PARAMETER_SETS, 1):
+        density, cdf = bruteForceCurves(x, parameters)
+        results.append(_result('set {} cdf vs brute force'.format(number),
+                               wienerCdf(x[np.newaxis, :], **parameters)[0], cdf, CDF_TOLERANCE))
+        results.append(_result('set {} density vs brute force'.format(number),
+                               wienerDensity(np.abs(x), x > 0, **parameters),
+                               density, DENSITY_TOLERANCE * density.max()))
+    return results
+
+
+def bruteForceCurves(x, parameters):
+    """
+    Returns density and cdf at signed response times x (negative at the lower threshold).
+    Variabilities are integrated by dense quadrature over the plain small-time series, the
+    cdf by integrating the density over a fine grid of response times.
+    """
+
+    density = np.empty(x.shape)
+    cdf = np.empty(x.shape)
+    lower = x < 0
+    step = BRUTE_FORCE_GRID[1] - BRUTE_FORCE_GRID[0]
+    for upper in (False, True):
+        inside = ~lower if upper else lower
+        density[inside] = _bruteForceDensity(np.abs(x[inside]), upper, parameters)
+
+        # Probability of a response at this threshold slower (lower) or faster (upper) than |x|
+        grid = _bruteForceDensity(BRUTE_FORCE_GRID[1:], upper, parameters)
+        integral = np.concatenate(([0.0], np.cumsum(0.5 * (grid[1:] + grid[:-1])) * step))
+        integral = np.concatenate(([0.0], integral))
+        below = np.interp(np.abs(x[inside]), BRUTE_FORCE_GRID, integral)
+        if upper:
+            cdf[inside] = lowerProbability + below
+        else:
+            lowerProbability = integral[-1]
+            cdf[inside] = lowerProbability - below
+    return density, cdf
+
+
+def _bruteForceDensity(t, upper, parameters):
+    """Density of response times t > 0 at one threshold, averaged over all quadrature nodes."""
+
+    a = parameters['a']
+    # Mirror upper threshold onto the lower one
+    zr = 1.0 - parameters['zr'] if upper else parameters['zr']
+    v = -parameters['v'] if upper else parameters['v']
+    t0 = parameters['t0'] + (0.5 if upper else -0.5) * parameters['d']
+
+    # Nodes and weights of each variability, a single node without it
+    drifts, driftWeights = _nodes('sv', parameters)
+    starts, startWeights = _nodes('szr', parameters)
+    shifts, shiftWeights = _nodes('st0', parameters)
+    drifts = v + np.sqrt(2.0) * parameters['sv'] * drifts
+    driftWeights = driftWeights / np.sqrt(np.pi)
+    starts = zr + 0.5 * parameters['szr'] * starts
+    startWeights = 0.5 * startWeights
+    shifts = t0 + 0.5 * parameters['st0'] * shifts
+    shiftWeights = 0.5 * shiftWeights
+
+    # Drifts along a first axis, summed up at once
+    drifts = drifts[:, np.newaxis]
+    driftWeights = driftWeights[:, np.newaxis]
+
+    density = np.zeros(t.shape)
+    k = np.arange(-BRUTE_FORCE_TERMS, BRUTE_FORCE_TERMS + 1)[:, np.newaxis]
+    for shift, shiftWeight in zip(shifts, shiftWeights):
+        decisionTime = t - shift
+        valid = decisionTime > 0
+        u = decisionTime[valid] / (a * a)
+        for start, startWeight in zip(starts, startWeights):
+            shifted = start + 2.0 * k
+            series = (shifted * np.exp(-shifted * shifted / (2.0 * u))).sum(axis=0) / np.sqrt(2.0 * np.pi * u ** 3)
+            drift = (driftWeights * np.exp(-drifts * a * start - 0.5 * drifts * drifts * decisionTime[valid])).sum(axis=0)
+            density[valid] += shiftWeight * startWeight * series / (a * a) * drift
+    return density
+
+
+def _nodes(name, parameters):
+    """Returns quadrature nodes and weights of a variability (Gauss-Hermite for sv, else Gauss-Legendre)."""
+
+    if parameters[name] <= 0:
+        return np.zeros(1), np.array([np.sqrt(np.pi) if name == 'sv' else 2.0])
+    if name == 'sv':
+        return np.polynomial.hermite.hermgauss(BRUTE_FORCE_NODES[name])
+    return np.polynomial.legendre.leggauss(BRUTE_FORCE_NODES[name])
+
+
+def _runPlot(program, parameters):
+    """Runs plot-cdf or plot-density, returns its curve as [x, y]."""
+
+    args = [program]
+    for key, option in OPTIONS.items():
+        args += [option, str(parameters[key])]
+    with tempfile.TemporaryDirectory() as directory:
+        outputFileName = directory + '/curve.lst'
+        subprocess.run(args + ['-p', str(REFERENCE_PRECISION), '-o', outputFileName], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        curve = np.loadtxt(outputFileName, ndmin=2)
+    return [curve[:, 0].tolist(), curve[:, 1].tolist()]
+
+
+def _result(label, values, reference, tolerance):
+    """Returns (label, maximum absolute deviation, True if within tolerance)."""
+
+    error = float(np.max(np.abs(values - reference)))
+    return label, error, error <= tolerance
+
+
+def parseArgs(argv):
+    """Parses command line arguments."""
+
+    parser = argparse.ArgumentParser(description='Validates the numpy diffusion model against fast-dm.')
+    parser.add_argument('--record', action='store_true', help='run fast-dm and store its curves as references')
+    parser.add_argument('--plot-cdf', default='fast-dm-bin/plot-cdf.exe', help='plot-cdf executable of fast-dm')
+    parser.add_argument('--plot-density', default='fast-dm-bin/plot-density.exe',
+                        help='plot-density executable of fast-dm')
+    parser.add_argument('--reference', default=os.path.dirname(os.path.abspath(__file__)) + '/' + REFERENCE_NAME,
+                        help='reference file (default: {} next to this script)'.format(REFERENCE_NAME))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Records or compares, returns the exit code."""
+
+    args = parseArgs(argv)
+
+    if args.record:
+        recordReferences(args.plot_cdf, args.plot_density, args.reference)
+        print('Reference curves of {} parameter sets written to {}'.format(len(PARAMETER_SETS), args.reference))
+        return 0
+
+    results = compareBruteForce()
+    if os.path.isfile(args.reference):
+        results += compareReferences(args.reference)
+    else:
+        print('No fast-dm references in {}, record them with --record'.format(args.reference))
+
+    for label, error, ok in results:
+        print('{:<32} max deviation {:.2e} {}'.format(label, error, 'ok' if ok else 'FAILED'))
+    return 0 if all(ok for label, error, ok in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import numpy as np
+
+
+"""Absolute error allowed when truncating the series of the standardized density."""
+DENSITY_EPSILON = 1e-10
+
+"""Number of Gauss-Legendre nodes integrating over the starting point (szr)."""
+SZR_NODES = 8
+
+"""Number of Gauss-Legendre nodes integrating densities over the non-decision time (st0)."""
+ST0_NODES = 16
+
+"""Number of Gauss-Hermite nodes integrating threshold probabilities over the drift (sv)."""
+SV_NODES = 16
+
+"""Number of grid points on which decision time cdfs are integrated (per parameter set)."""
+CDF_RESOLUTION = 4000
+
+
+def wienerDensity(rt, response, a, zr, v, t0, d=0.0, szr=0.0, sv=0.0, st0=0.0, p=0.0, contaminants=None,
+                  epsilon=DENSITY_EPSILON):
+    """
+    Returns the first-passage time density of the diffusion model for whole arrays
+    of response times rt (seconds) and responses (1 upper, 0 lower threshold).
+    All parameters may be scalars or arrays broadcastable to rt, so the density
+    of several parameter sets can be evaluated in one call. As in fast-dm, the
+    non-decision time at the upper threshold is t0 + d/2, at the lower t0 - d/2,
+    and a proportion p of responses are contaminants, uniformly distributed over
+    the range given by contaminants (default: range of rt) and both responses.
+    The limits of the range may be arrays broadcastable to rt as well.
+    Normally distributed drift (sv) is integrated analytically, uniformly distributed
+    starting point (szr) and non-decision time (st0) by Gauss-Legendre quadrature.
+    """
+
+    rt, response, a, zr, v, t0, d, szr, sv, st0, p = np.broadcast_arrays(
+        *[np.asarray(arg, dtype=float) for arg in (rt, response, a, zr, v, t0, d, szr, sv, st0, p)])
+    upper = response > 0.5
+
+    # Mirror upper threshold onto the lower one (drift and starting point flip)
+    w = np.where(upper, 1.0 - zr, zr)
+    drift = np.where(upper, -v, v)
+    nonDecision = np.where(upper, t0 + 0.5 * d, t0 - 0.5 * d)
+
+    # Quadrature nodes on [-1, 1], a single one without variability
+    zNodes, zWeights = np.polynomial.legendre.leggauss(SZR_NODES if np.any(szr > 0) else 1)
+    tNodes, tWeights = np.polynomial.legendre.leggauss(ST0_NODES if np.any(st0 > 0) else 1)
+
+    # Only non-decision times below rt contribute, integrating over just those avoids
+    # the kink at decision time zero, share is their proportion of the range of st0
+    lowest = nonDecision - 0.5 * st0
+    span = np.clip(rt - lowest, 0.0, st0)
+    share = np.where(st0 > 0, span / np.where(st0 > 0, st0, 1.0), 1.0)
+
+    # Density of decision times at the lower threshold, zero before t0
+    density = np.zeros(rt.shape)
+    for zNode, zWeight in zip(zNodes, zWeights):
+        wNode = w + 0.5 * szr * zNode
+        for tNode, tWeight in zip(tNodes, tWeights):
+            decisionTime = np.where(st0 > 0, rt - lowest - 0.5 * span * (tNode + 1.0), rt - nonDecision)
+            valid = decisionTime > 0
+            if valid.any():
+                density[valid] += 0.25 * zWeight * tWeight * share[valid] * _decisionDensity(
+                    decisionTime[valid], a[valid], wNode[valid], drift[valid], sv[valid], epsilon)
+
+    # Mix in uniform contaminants, half of them at each threshold
+    if np.any(p > 0):
+        low, high = contaminants if contaminants is not None else (rt.min(), rt.max())
+        inRange = (rt >= low) & (rt <= high)
+        uniform = np.where(inRange, 0.5 / np.maximum(high - low, np.finfo(float).eps), 0.0)
+        density = (1.0 - p) * density + p * uniform
+
+    return density
+
+
+def wienerCdf(x, a, zr, v, t0, d=0.0, szr=0.0, sv=0.0, st0=0.0, p=0.0, contaminants=None,
+              resolution=CDF_RESOLUTION):
+    """
+    Returns predicted cdfs for a batch of parameter sets, one row per parameter set
+    (e.g. participant), in one vectorized call. Parameters are scalars or 1d arrays,
+    x holds signed response times (negative at the lower threshold, as written by
+    plot-cdf), either a grid shared by all rows or one row per parameter set.
+    The cdf at x is the probability of a signed response time below x. The starting
+    point (szr) is integrated by Gauss-Legendre quadrature, the drift (sv) analytically,
+    and the non-decision time (st0) exactly over the integrated decision time cdf.
+    Contaminants (p) are handled as in wienerDensity, their range defaults to that of |x|
+    and its limits may be given per row.
+    """
+
+    # Bring parameters into column shape (rows, 1) and grid into (rows, points)
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(arg, dtype=float)) for arg in
+                                   (a, zr, v, t0, d, szr, sv, st0, p)])
+    a, zr, v, t0, d, szr, sv, st0, p = [param[:, np.newaxis] for param in params]
+    x = np.asarray(x, dtype=float)
+    x = np.broadcast_to(x, (a.shape[0], x.shape[-1]))
+
+    # Decision time grid of each row, long enough for the slowest non-decision time
+    fastest = t0 - 0.5 * np.abs(d) - 0.5 * st0
+    span = np.maximum(np.abs(x).max(axis=1, keepdims=True) - fastest, 1e-3)
+    step = span / (resolution - 1)
+    grid = step * np.arange(resolution)
+
+    # Gauss-Legendre nodes and weights for the starting point, on [-1, 1]
+    nodes, weights = np.polynomial.legendre.leggauss(SZR_NODES if np.any(szr > 0) else 1)
+
+    cdf = np.empty(x.shape)
+    for upper in (False, True):
+
+        # Mirror upper threshold onto the lower one
+        w = 1.0 - zr if upper else zr
+        drift = -v if upper else v
+        nonDecision = t0 + 0.5 * d if upper else t0 - 0.5 * d
+
+        # Decision time density and threshold probability, averaged over starting points
+        density = np.zeros(grid.shape)
+        for node, weight in zip(nodes, weights):
+            # First grid point is zero, where the density vanishes
+            density[:, 1:] += 0.5 * weight * _decisionDensity(grid[:, 1:], a, w + 0.5 * szr * node, drift, sv)
+        probability = lowerThresholdProbability(a, w, drift, szr, sv)
+
+        # Decision time cdf by cumulative trapezoidal integration
+        decisionCdf = _cumulativeIntegral(density, step)
+
+        # Shift by non-decision time, averaged over its uniform range if st0 > 0
+        times = np.abs(x) - nonDecision
+        withoutSt0 = _interpolateRows(decisionCdf, step, times)
+        integrated = _cumulativeIntegral(decisionCdf, step)
+        safeSt0 = np.where(st0 > 0, st0, 1.0)
+        withSt0 = (_interpolateRows(integrated, step, times + 0.5 * st0) -
+                   _interpolateRows(integrated, step, times - 0.5 * st0)) / safeSt0
+        thresholdCdf = np.where(st0 > 0, withSt0, withoutSt0)
+
+        # Combine: below zero lower responses slower than |x|, above zero all lower plus faster upper
+        if upper:
+            cdf = np.where(x >= 0, lowerProbability + thresholdCdf, cdf)
+        else:
+            lowerProbability = probability
+            cdf = np.where(x < 0, probability - thresholdCdf, cdf)
+
+    return np.clip(mixContaminants(cdf, x, p, contaminants), 0.0, 1.0)
+
+
+def mixContaminants(cdf, x, p, contaminants=None):
+    """
+    Mixes a proportion p (column of shape (rows, 1)) of uniform contaminants, half of them at
+    each threshold, into cdfs (rows, points) at signed response times x. The contaminants' range
+    defaults to that of |x|, its limits may be given per row.
+    """
+
+    if not np.any(p > 0):
+        return cdf
+    low, high = contaminants if contaminants is not None else (np.abs(x).min(), np.abs(x).max())
+    low, high = [np.reshape(limit, (-1, 1)) if np.ndim(limit) else limit for limit in (low, high)]
+    width = np.maximum(high - low, np.finfo(float).eps)
+    uniform = np.where(x < 0, 0.5 * np.clip((high + x) / width, 0.0, 1.0),
+                       0.5 + 0.5 * np.clip((x - low) / width, 0.0, 1.0))
+    return (1.0 - p) * cdf + p * uniform
+
+
+def lowerThresholdProbability(a, w, v, szr=0.0, sv=0.0):
+    """
+    Returns the probability of reaching the lower threshold from the relative starting point w,
+    averaged over the starting point (szr, Gauss-Legendre) and the drift (sv, Gauss-Hermite).
+    """
+
+    nodes, weights = np.polynomial.legendre.leggauss(SZR_NODES if np.any(np.asarray(szr) > 0) else 1)
+    return sum(0.5 * weight * _lowerProbability(a, w + 0.5 * szr * node, v, sv) for node, weight in zip(nodes, weights))
+
+
+def standardDensity(u, w, epsilon=DENSITY_EPSILON):
+    """
+    Returns the density of the standardized process (a = 1, v = 0) at the lower threshold
+    for normalized times u > 0 and relative starting points w (Navarro & Fuss, 2009).
+    Each time is evaluated by the small-time or the large-time series, whichever needs
+    fewer terms for the error epsilon, and each series is truncated accordingly.
+    """
+
+    u, w = np.broadcast_arrays(np.asarray(u, dtype=float), np.asarray(w, dtype=float))
+    kSmall, kLarge = _numberOfTerms(u, epsilon)
+
+    # Evaluate each series only where it converges faster
+    density = np.empty(u.shape)
+    small = kSmall <= kLarge
+    if small.any():
+        density[small] = _smallTimeSeries(u[small], w[small], int(np.ceil(kSmall[small].max())))
+    if (~small).any():
+        density[~small] = _largeTimeSeries(u[~small], w[~small], int(np.ceil(kLarge[~small].max())))
+
+    # Truncated series may become slightly negative far in the tails
+    return np.maximum(density, 0.0)
+
+
+def _decisionDensity(t, a, w, v, sv, epsilon=DENSITY_EPSILON):
+    """Returns the density of decision times t > 0 at the lower threshold, integrated over sv."""
+
+    scale = 1.0 + sv * sv * t
+    return np.exp(((a * w * sv) ** 2 - 2.0 * a * v * w - v * v * t) / (2.0 * scale)) / \
+        (np.sqrt(scale) * a * a) * standardDensity(t / (a * a), w, epsilon)
+
+
+def _lowerProbability(a, w, v, sv):
+    """Returns the probability of reaching the lower threshold, integrated over sv by Gauss-Hermite quadrature."""
+
+    nodes, weights = np.polynomial.hermite.hermgauss(SV_NODES if np.any(sv > 0) else 1)
+    probability = 0.0
+    for node, weight in zip(nodes, weights):
+        drift = v + np.sqrt(2.0) * sv * node
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            value = np.expm1(2.0 * drift * a * (1.0 - w)) / np.expm1(2.0 * drift * a)
+        # Zero drift, the walk is symmetric
+        value = np.where(np.abs(drift * a) < 1e-10, 1.0 - w, value)
+        probability = probability + weight / np.sqrt(np.pi) * value
+    return probability
+
+
+def _cumulativeIntegral(values, step):
+    """Returns the running trapezoidal integral along rows of values sampled with uniform step (per row)."""
+
+    integral = np.zeros(values.shape)
+    integral[:, 1:] = np.cumsum(0.5 * (values[:, 1:] + values[:, :-1]), axis=1) * step
+    return integral
+
+
+def _interpolateRows(values, step, times):
+    """Linearly interpolates rows of values sampled at 0, step, 2 * step, ..., zero before 0, last value beyond."""
+
+    position = np.clip(times / step, 0.0, values.shape[1] - 1.0)
+    lower = np.minimum(position.astype(int), values.shape[1] - 2)
+    fraction = position - lower
+    rows = np.arange(values.shape[0])[:, np.newaxis]
+    interpolated = values[rows, lower] * (1.0 - fraction) + values[rows, lower + 1] * fraction
+    return np.where(times > 0, interpolated, 0.0)
+
+
+def _numberOfTerms(u, epsilon):
+    """Returns the numbers of terms of the small- and large-time series needed for the error epsilon."""
+
+    # Small-time series
+    bound = 2.0 * np.sqrt(2.0 * np.pi * u) * epsilon
+    kSmall = np.full(u.shape, 2.0)
+    tight = bound < 1.0
+    kSmall[tight] = np.maximum(2.0 + np.sqrt(-2.0 * u[tight] * np.log(bound[tight])), np.sqrt(u[tight]) + 1.0)
+
+    # Large-time series
+    bound = np.pi * u * epsilon
+    kLarge = 1.0 / (np.pi * np.sqrt(u))
+    tight = bound < 1.0
+    kLarge[tight] = np.maximum(np.sqrt(-2.0 * np.log(bound[tight]) / (np.pi * np.pi * u[tight])), kLarge[tight])
+
+    return kSmall, kLarge
+
+
+def _smallTimeSeries(u, w, nTerms):
+    """Small-time series of the standardized density, converges fast for small u."""
+
+    k = np.arange(-((nTerms - 1) // 2), (nTerms - 1) // 2 + (nTerms - 1) % 2 + 1)[:, np.newaxis]
+    shifted = w + 2.0 * k
+    return (shifted * np.exp(-shifted * shifted / (2.0 * u))).sum(axis=0) / np.sqrt(2.0 * np.pi * u ** 3)
+
+
+def _largeTimeSeries(u, w, nTerms):
+    """Large-time series of the standardized density, converges fast for large u."""
+
+    k = np.arange(1, nTerms + 1)[:, np.newaxis]
+    return np.pi * (k * np.exp(-0.5 * k * k * np.pi * np.pi * u) * np.sin(k * np.pi * w)).sum(axis=0)
@@ -8,6 +8,7 @@ from PyQt5.QtGui import QPixmap
 import qdarkstyle
 from fd_main_window import FastDmMainWindow
 import ctypes
+import multiprocessing
 import time
 
 
@@ -18,6 +19,11 @@ os.chdir(PATH)
 
 
 if __name__ == '__main__':
+    # =============================================================== #
+    #            SUPPORT WORKER PROCESSES OF FROZEN BUILDS            #
+    # =============================================================== #
+    multiprocessing.freeze_support()
+
     # =============================================================== #
     #               SET APP ID SO ICON IS VISIBLE                     #
     # =============================================================== #